@@ -3,25 +3,45 @@ from fastapi.middleware.cors import CORSMiddleware
 import uuid
 from datetime import datetime
 import os
+import re
 import logging
-import json
+import orjson
 import shutil
 from typing import Dict, Any, List, Tuple, Optional
-from azure_ocr import Inferencer, save_to_markdown
-from convert_to_json import convert_to_json, read_markdown_file, extract_ocr_text
-from pdf2image import convert_from_path
+from azure_ocr import Inferencer, save_to_markdown, warm_up
+from convert_to_json import convert_to_json, read_ocr_text
+import fitz
+try:
+    import pyvips
+except ImportError:  # libvips is optional; PyMuPDF is used when it's missing
+    pyvips = None
 from PIL import Image
 from fastapi.responses import StreamingResponse
 from pathlib import Path
-from email.mime.multipart import MIMEMultipart
-from email.mime.base import MIMEBase
-from email import encoders
 from starlette.background import BackgroundTask
-import io
 import subprocess
 import sys
+import asyncio
+from contextlib import asynccontextmanager
+import aiofiles
+import aiofiles.os
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Do the cold-start work (Azure client) before serving.
+
+    A failed warm-up is only logged: /upload and /v1/edited don't need OCR,
+    and process_image() builds its own client when none is shared.
+    """
+    try:
+        await asyncio.to_thread(warm_up)
+        app.state.inferencer = Inferencer()
+    except Exception as exc:
+        logger.error(f"OCR warm-up failed, continuing without a shared inferencer: {exc}", exc_info=True)
+    yield
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 app.add_middleware(
@@ -38,6 +58,21 @@ OUTPUTS_DIR = "outputs"
 os.makedirs(TEMP_DIR, exist_ok=True)
 os.makedirs(OUTPUTS_DIR, exist_ok=True)
 
+# Maximum number of PDF pages sent to Azure OCR at the same time
+OCR_CONCURRENCY = int(os.getenv("OCR_CONCURRENCY", "8"))
+
+# JPEG settings for rendered PDF pages, built once and reused for every
+# page. OCR gains nothing above ~85, and skipping the Huffman optimisation
+# pass keeps encoding fast; smaller files also upload to Azure faster.
+JPEG_QUALITY = 90
+VIPS_JPEG_OPTIONS = {"Q": JPEG_QUALITY, "optimize_coding": False, "interlace": False}
+
+# Read size used when streaming uploads to disk
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# First letter of the first two names and the whole last name (3+ names)
+_INITIALS_RE = re.compile(r"(\S)\S*\s+(\S)\S*\s+(?:.*\s)?(\S+)", re.DOTALL)
+
 # Use absolute paths anchored at the directory that contains api.py so
 # background tasks have consistent locations regardless of the working
 # directory the server is started from.
@@ -60,52 +95,101 @@ logger = logging.getLogger(__name__)
 # Utility cleanup used by /v1/edited endpoint
 # ---------------------------------------------------------------------------
 
-def _cleanup_after_send(paths: List[Path]):
-    """Background task: move each sent file into ./archives/<YYYY-MM-DD>/.
+def _archive_file(p: Path, date_dir: Path) -> None:
+    """Move a single sent file into *date_dir*, logging the outcome."""
+    try:
+        target = date_dir / p.name
+        try:
+            # Same filesystem: a single rename syscall
+            os.rename(p, target)
+        except OSError:
+            # Cross-device (or otherwise unrenameable): copy + delete
+            shutil.move(str(p), target)
+        # Log the absolute path or relative to archive root to avoid Path errors
+        try:
+            logger.info(f"Archived processed file → {target.relative_to(Path.cwd())}")
+        except Exception:
+            logger.info(f"Archived processed file → {target}")
+    except Exception as exc:
+        logger.error(f"Failed to archive {p}: {exc}")
 
-    Keeps processed records for auditing while preventing the worker from
-    re-processing the same payload on the next poll.
-    """
+def _archive_dir() -> Path:
+    """Return today's ./archives/<YYYY-MM-DD>/ directory, creating it if needed."""
     date_dir = ARCHIVE_ROOT / datetime.now().strftime("%Y-%m-%d")
     date_dir.mkdir(parents=True, exist_ok=True)
+    return date_dir
 
+def archive_sent_files(paths: List[Path]) -> None:
+    """Move each sent file into ./archives/<YYYY-MM-DD>/ (blocking).
+
+    For synchronous callers such as automate_upload.py, which must not
+    leave the processed payload where the next run would pick it up again.
+    """
+    date_dir = _archive_dir()
     for p in paths:
-        try:
-            target = date_dir / p.name
-            shutil.move(str(p), target)
-            # Log the absolute path or relative to archive root to avoid Path errors
-            try:
-                logger.info(f"Archived processed file → {target.relative_to(Path.cwd())}")
-            except Exception:
-                logger.info(f"Archived processed file → {target}")
-        except Exception as exc:
-            logger.error(f"Failed to archive {p}: {exc}")
+        _archive_file(p, date_dir)
+
+async def _cleanup_after_send(paths: List[Path]):
+    """Background task: move each sent file into ./archives/<YYYY-MM-DD>/.
+
+    Keeps processed records for auditing while preventing the worker from
+    re-processing the same payload on the next poll. The moves run
+    concurrently in worker threads without blocking the event loop.
+    """
+    date_dir = _archive_dir()
+    await asyncio.gather(*[asyncio.to_thread(_archive_file, p, date_dir) for p in paths])
 
 # ---------------------------------------------------------------------------
 # Helper functions for the new EHR upload endpoints
 # ---------------------------------------------------------------------------
 
 def miclinic_get_latest_files() -> Tuple[Optional[Path], Optional[Path]]:
-    """Return newest JSON and PDF uploaded for EHR processing."""
-    json_files = list(MICLINIC_UPLOAD_DIR.glob("*.json"))
-    pdf_files = list(MICLINIC_UPLOAD_DIR.glob("*.pdf"))
+    """Return newest JSON and PDF uploaded for EHR processing.
 
-    latest_json = max(json_files, key=lambda p: p.stat().st_mtime, default=None)
-    latest_pdf = max(pdf_files, key=lambda p: p.stat().st_mtime, default=None)
+    Walks the upload directory once with ``os.scandir`` and keeps the
+    newest match of each type, reusing the stat info cached on each entry.
+    """
+    latest_json: Optional[Path] = None
+    latest_pdf: Optional[Path] = None
+    json_mtime = pdf_mtime = -1.0
+
+    with os.scandir(MICLINIC_UPLOAD_DIR) as entries:
+        for entry in entries:
+            name = entry.name.lower()
+            if name.endswith(".json"):
+                mtime = entry.stat().st_mtime
+                if mtime > json_mtime:
+                    json_mtime, latest_json = mtime, Path(entry.path)
+            elif name.endswith(".pdf"):
+                mtime = entry.stat().st_mtime
+                if mtime > pdf_mtime:
+                    pdf_mtime, latest_pdf = mtime, Path(entry.path)
 
     return latest_json, latest_pdf
 
+async def _publish_upload(dest_path: Path, content: bytes) -> None:
+    """Write *content* to *dest_path* in the upload directory atomically.
+
+    The API may run as several worker processes, so the bytes go to a
+    ``.part`` file first and are renamed into place; /v1/edited never sees
+    (or archives) a half-written JSON or PDF.
+    """
+    part_path = dest_path.with_name(dest_path.name + ".part")
+    async with aiofiles.open(part_path, "wb") as out:
+        await out.write(content)
+    await aiofiles.os.replace(part_path, dest_path)
+
 def get_patient_name_from_json(json_data: Dict[str, Any]) -> str:
     """Extract and format patient name from JSON data."""
     try:
         full_name = json_data["ocr_contents"]["insured"]["insuredName"]
-        # Split name into parts
-        name_parts = full_name.split()
-        if len(name_parts) >= 3:
-            return f"{name_parts[0][0]}_{name_parts[1][0]}_{name_parts[-1]}"
+        # Initials of the first two names plus the last name, in one match
+        match = _INITIALS_RE.fullmatch(full_name.strip())
+        if match:
+            return f"{match[1]}_{match[2]}_{match[3]}"
         return full_name.replace(" ", "_")
-    except (KeyError, IndexError):
-        return str(uuid.uuid4())[:8]  # Fallback to UUID if name extraction fails
+    except (KeyError, TypeError, AttributeError):
+        return uuid.uuid4().hex[:8]  # Fallback to UUID if name extraction fails
 
 def create_date_directory(date_str: str) -> str:
     """Create and return path to date-based directory."""
@@ -114,57 +198,94 @@ def create_date_directory(date_str: str) -> str:
     return date_dir
 
 def save_file(source_path: str, dest_path: str, copy_instead_of_move: bool = False) -> None:
-    """Save a file by either copying or moving it."""
+    """Save a file by either copying or moving it.
+
+    Moves are a plain rename unless the paths are on different filesystems.
+    """
     if copy_instead_of_move:
         shutil.copy(source_path, dest_path)
     else:
-        shutil.move(source_path, dest_path)
+        try:
+            os.replace(source_path, dest_path)
+        except OSError:
+            shutil.move(source_path, dest_path)
 
 def is_pdf(filename: str) -> bool:
     """Check if a file is a PDF based on extension."""
     return filename.lower().endswith('.pdf')
 
-def convert_pdf_to_jpeg(pdf_path: str) -> List[str]:
-    """Convert PDF to JPEG images and return paths to the images."""
+def _convert_pdf_vips(pdf_path: str, images_dir: str, dpi: int = 300) -> List[str]:
+    """Render every page with a single libvips ``pdfload`` call.
+
+    With ``n=-1`` vips loads all pages as one tall image, reusing the PDF
+    renderer across pages; each page is then cropped out and saved.
+    """
+    image = pyvips.Image.pdfload(pdf_path, n=-1, dpi=dpi)
+    if image.hasalpha():
+        image = image.flatten(background=255)
+    page_height = image.get("page-height")
+
+    image_paths = []
+    for i in range(image.height // page_height):
+        image_path = os.path.join(images_dir, f"page_{i+1}.jpg")
+        image.crop(0, i * page_height, image.width, page_height).jpegsave(image_path, **VIPS_JPEG_OPTIONS)
+        image_paths.append(image_path)
+
+    return image_paths
+
+def convert_pdf_to_jpeg(pdf_path: str, dpi: int = 300) -> List[str]:
+    """Convert PDF to JPEG images and return paths to the images.
+
+    Uses libvips when pyvips is installed, otherwise pages are rasterised
+    in-process with PyMuPDF, so there is no pdftoppm subprocess and no PIL
+    decode/re-encode round trip per page.
+    """
     # Create a directory for the images
     pdf_name = os.path.splitext(os.path.basename(pdf_path))[0]
     images_dir = os.path.join(TEMP_DIR, f"{pdf_name}_images")
     os.makedirs(images_dir, exist_ok=True)
-    
-    # Convert PDF to images
-    images = convert_from_path(pdf_path, dpi=300)
+
+    if pyvips is not None:
+        return _convert_pdf_vips(pdf_path, images_dir, dpi=dpi)
+
     image_paths = []
-    
-    # Save each image
-    for i, image in enumerate(images):
-        image_path = os.path.join(images_dir, f"page_{i+1}.jpg")
-        image.save(image_path, "JPEG", quality=95)
-        image_paths.append(image_path)
-    
+
+    # Render and save each page
+    with fitz.open(pdf_path) as doc:
+        for i, page in enumerate(doc):
+            pixmap = page.get_pixmap(dpi=dpi, alpha=False)
+            image_path = os.path.join(images_dir, f"page_{i+1}.jpg")
+            pixmap.save(image_path, jpg_quality=JPEG_QUALITY)
+            image_paths.append(image_path)
+
     return image_paths
 
-def process_image(image_path: str, output_md_path: str) -> Optional[Dict[str, Any]]:
+def process_image(
+    image_path: str,
+    output_md_path: str,
+    inferencer: Optional[Inferencer] = None,
+) -> Optional[Dict[str, Any]]:
     """Process a single image through OCR and JSON conversion."""
     try:
-        # OCR processing
-        inferencer = Inferencer()
+        # OCR processing (the app shares one warm inferencer across requests)
+        inferencer = inferencer or Inferencer()
         ocr_results = inferencer.run_inference(image_path)
         save_to_markdown(ocr_results, output_md_path, image_path)
         
         # Convert to JSON
-        markdown_content = read_markdown_file(output_md_path)
-        ocr_text = extract_ocr_text(markdown_content)
+        ocr_text = read_ocr_text(output_md_path)
         json_data = convert_to_json(ocr_text, os.path.basename(output_md_path))
         
         return json_data
     except Exception as e:
-        print(f"Error processing image {image_path}: {str(e)}")
+        logger.error(f"Error processing image {image_path}: {str(e)}")
         return None
 
 def save_json(json_data: Dict[str, Any], output_path: str) -> None:
     """Save JSON data to a file."""
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(json_data, f, indent=2, ensure_ascii=False)
+    Path(output_path).write_bytes(
+        orjson.dumps(json_data, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS)
+    )
 
 def build_response(
     status: str, 
@@ -192,40 +313,50 @@ async def process_document(file: UploadFile = File(...)):
         original_filename = file.filename
         _, ext = os.path.splitext(original_filename)
         
-        # Create temporary file path for the uploaded file
-        temp_upload_path = os.path.join(TEMP_DIR, f"upload_{file_id}{ext}")
-        temp_files.append(temp_upload_path)
-        
-        # Save uploaded file to temporary location
-        with open(temp_upload_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
         # Get the output directory
         date_dir = create_date_directory(current_date)
         
+        # The upload lands in the output directory under a provisional name
+        # and is renamed once the patient name is known, so it is written once
+        temp_upload_path = os.path.join(date_dir, f"_incoming_{file_id}{ext}")
+        temp_files.append(temp_upload_path)
+        
+        # Stream the uploaded file to the provisional location off the event loop
+        async with aiofiles.open(temp_upload_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                await buffer.write(chunk)
+        
         # Process file based on type
         if is_pdf(original_filename):
             # Convert PDF to JPEG
             image_paths = convert_pdf_to_jpeg(temp_upload_path)
             temp_files.extend(image_paths)
             
-            # Track all JSON results
-            all_json_data = []
-            all_md_paths = []
-            
-            # Process each page
-            for i, image_path in enumerate(image_paths):
-                # Set up temporary paths
-                temp_md_path = os.path.join(TEMP_DIR, f"temp_{file_id}_page_{i+1}.md")
-                temp_json_path = os.path.join(TEMP_DIR, f"temp_{file_id}_page_{i+1}.json")
-                temp_files.extend([temp_md_path])
-                all_md_paths.append(temp_md_path)
-                
-                # Process the image
-                json_data = process_image(image_path, temp_md_path)
-                
-                if json_data:
-                    all_json_data.append(json_data)
+            # Set up temporary markdown paths for every page up front
+            all_md_paths = [
+                os.path.join(TEMP_DIR, f"temp_{file_id}_page_{i+1}.md")
+                for i in range(len(image_paths))
+            ]
+            temp_files.extend(all_md_paths)
+
+            # Process the pages concurrently. OCR is dominated by Azure round
+            # trips, so each page runs in a worker thread and the semaphore
+            # caps how many requests are in flight at once.
+            semaphore = asyncio.Semaphore(OCR_CONCURRENCY)
+
+            async def _process_page(image_path: str, md_path: str) -> Optional[Dict[str, Any]]:
+                async with semaphore:
+                    return await asyncio.to_thread(
+                        process_image, image_path, md_path, getattr(app.state, "inferencer", None)
+                    )
+
+            page_results = await asyncio.gather(*[
+                _process_page(image_path, md_path)
+                for image_path, md_path in zip(image_paths, all_md_paths)
+            ])
+
+            # Track all JSON results, preserving page order
+            all_json_data = [json_data for json_data in page_results if json_data]
             
             # Use the first page's JSON for patient name if available
             if all_json_data:
@@ -236,24 +367,25 @@ async def process_document(file: UploadFile = File(...)):
                 patient_name = str(uuid.uuid4())[:8]
                 json_data = {}
             
-            # Save the original PDF
+            # Publish the original PDF under its final name
             final_pdf_path = os.path.join(date_dir, f"{patient_name}.pdf")
-            save_file(temp_upload_path, final_pdf_path, copy_instead_of_move=True)
+            os.replace(temp_upload_path, final_pdf_path)
             
-            # Save all images and markdown files
-            image_file_paths = []
-            md_file_paths = []
-            
-            for i, (image_path, md_path) in enumerate(zip(image_paths, all_md_paths)):
-                # Save image
-                final_image_path = os.path.join(date_dir, f"{patient_name}_page_{i+1}.jpg")
-                save_file(image_path, final_image_path, copy_instead_of_move=True)
-                image_file_paths.append(final_image_path)
-                
-                # Save markdown
-                final_md_path = os.path.join(date_dir, f"{patient_name}_page_{i+1}.md")
-                save_file(md_path, final_md_path, copy_instead_of_move=True)
-                md_file_paths.append(final_md_path)
+            # Move all images and markdown files into place concurrently
+            image_file_paths = [
+                os.path.join(date_dir, f"{patient_name}_page_{i+1}.jpg")
+                for i in range(len(image_paths))
+            ]
+            md_file_paths = [
+                os.path.join(date_dir, f"{patient_name}_page_{i+1}.md")
+                for i in range(len(all_md_paths))
+            ]
+            await asyncio.gather(*[
+                asyncio.to_thread(save_file, source_path, dest_path)
+                for source_path, dest_path in zip(
+                    image_paths + all_md_paths, image_file_paths + md_file_paths
+                )
+            ])
             
             # Save the combined JSON or first page JSON
             final_json_path = os.path.join(date_dir, f"{patient_name}.json")
@@ -294,7 +426,7 @@ async def process_document(file: UploadFile = File(...)):
             temp_files.append(temp_md_path)
             
             # Process the image
-            json_data = process_image(temp_upload_path, temp_md_path)
+            json_data = process_image(temp_upload_path, temp_md_path, getattr(app.state, "inferencer", None))
             
             if not json_data:
                 return build_response(
@@ -311,9 +443,9 @@ async def process_document(file: UploadFile = File(...)):
             final_md_path = os.path.join(date_dir, f"{patient_name}.md")
             final_json_path = os.path.join(date_dir, f"{patient_name}.json")
             
-            # Save files
-            save_file(temp_upload_path, final_file_path, copy_instead_of_move=True)
-            save_file(temp_md_path, final_md_path, copy_instead_of_move=True)
+            # Save files (the temporary copies are not needed afterwards)
+            os.replace(temp_upload_path, final_file_path)
+            save_file(temp_md_path, final_md_path)
             save_json(json_data, final_json_path)
             
             # Return response
@@ -389,7 +521,7 @@ async def miclinic_upload_files(background_tasks: BackgroundTasks, files: List[U
         dest_path = MICLINIC_UPLOAD_DIR / unique_name
 
         try:
-            dest_path.write_bytes(content)
+            await _publish_upload(dest_path, content)
             saved_files.append(unique_name)
             logger.info(f"/ehr/upload saved file: {unique_name}")
         except Exception as exc:
@@ -406,53 +538,47 @@ async def miclinic_upload_files(background_tasks: BackgroundTasks, files: List[U
 
 @app.get("/v1/edited")
 async def miclinic_json():
-    """Return latest JSON and PDF as multipart/form-data for the automation worker."""
+    """Stream latest JSON and PDF as raw multipart parts for the automation worker."""
     json_file, pdf_file = miclinic_get_latest_files()
 
     if not json_file and not pdf_file:
         logger.warning("/v1/edited: No JSON or PDF available in uploads directory")
         raise HTTPException(status_code=404, detail="No JSON or PDF files found")
 
-    msg = MIMEMultipart()
-
-    if json_file:
-        try:
-            with json_file.open("rb") as f:
-                part = MIMEBase("application", "json")
-                part.set_payload(f.read())
-            encoders.encode_base64(part)
-            part.add_header("Content-Disposition", f'attachment; filename="{json_file.name}"')
-            part.add_header("Content-Type", "application/json")
-            msg.attach(part)
-            logger.info(f"/v1/edited attached JSON: {json_file.name}")
-        except Exception as exc:
-            logger.error(f"Could not attach JSON file {json_file.name}: {exc}")
-            raise HTTPException(status_code=500, detail=str(exc))
-
-    if pdf_file:
-        try:
-            with pdf_file.open("rb") as f:
-                part = MIMEBase("application", "pdf")
-                part.set_payload(f.read())
-            encoders.encode_base64(part)
-            part.add_header("Content-Disposition", f'attachment; filename="{pdf_file.name}"')
-            part.add_header("Content-Type", "application/pdf")
-            msg.attach(part)
-            logger.info(f"/v1/edited attached PDF: {pdf_file.name}")
-        except Exception as exc:
-            logger.error(f"Could not attach PDF file {pdf_file.name}: {exc}")
-            raise HTTPException(status_code=500, detail=str(exc))
-
-    boundary = msg.get_boundary()
-    buffer = io.BytesIO()
-    buffer.write(msg.as_bytes())
-    buffer.seek(0)
+    boundary = uuid.uuid4().hex
+    parts = [
+        (path, content_type)
+        for path, content_type in ((json_file, "application/json"), (pdf_file, "application/pdf"))
+        if path
+    ]
+
+    async def stream_parts():
+        # Top-level MIME headers are part of the body so the payload can also
+        # be fed straight into email.parser.BytesParser; the worker's streaming
+        # parser skips them as preamble.
+        yield (
+            f'Content-Type: multipart/mixed; boundary="{boundary}"\r\n'
+            "MIME-Version: 1.0\r\n\r\n"
+        ).encode()
+        for path, content_type in parts:
+            yield (
+                f"--{boundary}\r\n"
+                f"Content-Type: {content_type}\r\n"
+                f'Content-Disposition: attachment; filename="{path.name}"\r\n'
+                "Content-Transfer-Encoding: binary\r\n\r\n"
+            ).encode()
+            async with aiofiles.open(path, "rb") as f:
+                while chunk := await f.read(UPLOAD_CHUNK_SIZE):
+                    yield chunk
+            yield b"\r\n"
+            logger.info(f"/v1/edited streamed {content_type}: {path.name}")
+        yield f"--{boundary}--\r\n".encode()
 
     return StreamingResponse(
-        buffer,
-        media_type=f"multipart/form-data; boundary={boundary}",
+        stream_parts(),
+        media_type=f"multipart/mixed; boundary={boundary}",
         headers={"Content-Disposition": "attachment"},
-        background=BackgroundTask(_cleanup_after_send, [p for p in (json_file, pdf_file) if p]),
+        background=BackgroundTask(_cleanup_after_send, [path for path, _ in parts]),
     )
 
 @app.post("/v1/edited")
@@ -463,16 +589,28 @@ async def receive_edited(
 ):
     # --- handle the JSON report -----------------------------------------
     raw_json = await json_file.read()
-    data     = json.loads(raw_json)              # parse if you need it
-    (MICLINIC_UPLOAD_DIR / json_file.filename).write_bytes(raw_json)
+    data     = orjson.loads(raw_json)            # parse if you need it
+    await _publish_upload(MICLINIC_UPLOAD_DIR / json_file.filename, raw_json)
 
     # --- handle the extra PDFs/images -----------------------------------
     for f in (file1, file2):
         if f:                       # skip None
-            (MICLINIC_UPLOAD_DIR / f.filename).write_bytes(await f.read())
+            await _publish_upload(MICLINIC_UPLOAD_DIR / f.filename, await f.read())
 
     return {"status": "success"}
 
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run("api:app", host="0.0.0.0", port=8007, reload=True)
\ No newline at end of file
+
+    # Set DEV=1 for the single-process auto-reloading server
+    if os.getenv("DEV"):
+        uvicorn.run("api:app", host="0.0.0.0", port=8007, reload=True)
+    else:
+        uvicorn.run(
+            "api:app",
+            host="0.0.0.0",
+            port=8007,
+            workers=max(2, (os.cpu_count() or 1) // 2),
+            loop="uvloop",
+            http="httptools",
+        )
\ No newline at end of file
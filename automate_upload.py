@@ -19,14 +19,18 @@ import requests
 import os
 import re
 import tempfile
+import time
+import numpy as np
 from datetime import datetime
+from functools import lru_cache
 from browser_use import BrowserConfig, Browser
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from fuzzywuzzy import fuzz, process
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
 from mimetypes import guess_extension
 from pathlib import Path
-from api import MICLINIC_UPLOAD_DIR, _cleanup_after_send
+from api import MICLINIC_UPLOAD_DIR, archive_sent_files
 from dotenv import load_dotenv
 from typing import Dict, Any
 
@@ -58,13 +62,97 @@ sensitive_data = {
     "password": "@dm!n"
 }
 
+# Browser reuse between runs: attach to a long-lived browser over CDP when
+# BROWSER_CDP_URL is set, otherwise launch with a persistent profile directory
+BROWSER_CDP_URL = os.getenv("BROWSER_CDP_URL")
+# The profile holds session cookies, so it lives outside the source tree by default
+BROWSER_PROFILE_DIR = os.getenv(
+    "BROWSER_PROFILE_DIR",
+    os.path.join(os.path.expanduser("~"), ".cache", "document-extractor", "browser_profile")
+)
+
+# Requests the form never needs.  Stylesheets are kept: Kendo shows and hides
+# its lists through CSS, and the visibility waits depend on that.
+_BLOCKED_RESOURCE_TYPES = frozenset({"image", "font", "media"})
+
+def block_unneeded_resources(page) -> None:
+    """Abort image, font and media requests made by *page*."""
+    page.route(
+        "**/*",
+        lambda route: route.abort() if route.request.resource_type in _BLOCKED_RESOURCE_TYPES else route.continue_()
+    )
+
+# ------------------------------------------------------------------
+# Dropdown cache.  Each upload runs this script in a fresh process, so the
+# cache is kept in a small JSON file between runs.  It holds the full option
+# lists of static arrow-opened dropdowns (keyed by list id) and the values
+# that were successfully picked for a given (list id, key words) pair.
+# Entries older than DROPDOWN_CACHE_TTL seconds are ignored.
+# ------------------------------------------------------------------
+DROPDOWN_CACHE_FILE = Path(os.getenv("DROPDOWN_CACHE_FILE", Path(tempfile.gettempdir()) / "dropdown_cache.json"))
+DROPDOWN_CACHE_TTL = 300
+
+_OPTIONS_CACHE: Dict[str, list] = {}
+_MATCH_CACHE: Dict[str, list] = {}
+# Every option seen in the typed-search dropdowns, keyed by list id
+_SEEN_OPTIONS: Dict[str, list] = {}
+
+def load_dropdown_cache() -> None:
+    """Load the dropdown cache written by earlier runs, if any."""
+    try:
+        with open(DROPDOWN_CACHE_FILE, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        _OPTIONS_CACHE.update(data.get("options", {}))
+        _MATCH_CACHE.update(data.get("matches", {}))
+        _SEEN_OPTIONS.update(data.get("seen", {}))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Ignoring unreadable dropdown cache {DROPDOWN_CACHE_FILE}: {str(e)}")
+
+def save_dropdown_cache() -> None:
+    """Persist the fresh dropdown cache entries for the next run."""
+    now = time.time()
+    data = {
+        name: {k: v for k, v in cache.items() if now - v[0] < DROPDOWN_CACHE_TTL}
+        for name, cache in (("options", _OPTIONS_CACHE), ("matches", _MATCH_CACHE), ("seen", _SEEN_OPTIONS))
+    }
+    try:
+        with open(DROPDOWN_CACHE_FILE, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+    except OSError as e:
+        logger.warning(f"Failed to save dropdown cache {DROPDOWN_CACHE_FILE}: {str(e)}")
+
+def _cache_get(cache: Dict[str, list], key: str):
+    entry = cache.get(key)
+    if entry and time.time() - entry[0] < DROPDOWN_CACHE_TTL:
+        return entry[1]
+    return None
+
+def _cache_put(cache: Dict[str, list], key: str, value) -> None:
+    cache[key] = [time.time(), value]
+
+def _remember_options(list_id: str, options: list) -> None:
+    """Add *options* to the options seen so far in the list *list_id*."""
+    known = _cache_get(_SEEN_OPTIONS, list_id) or []
+    known_set = set(known)
+    _cache_put(_SEEN_OPTIONS, list_id, known + [opt for opt in options if opt not in known_set])
+
+# Text inside parentheses, e.g. the short name in "Bupa Arabia (BUPA)"
+_PAREN_RE = re.compile(r'\((.*?)\)')
+# Single-pass character replacements used when cleaning names and options
+_PAREN_TABLE = str.maketrans("()", "  ")
+_OPTION_CLEAN_TABLE = str.maketrans("-,()", "    ")
+# Words that don't help tell insurance companies apart
+_GENERIC_TERMS = frozenset({"the", "and", "company", "reinsurance", "cooperative", "complex", "insurance"})
+
+@lru_cache(maxsize=2048)
 def extract_key_words(value: str) -> str:
     """Extracts key words from insurance names, handling parentheses, camelCase, and 'Al' prefixes."""
     if not value:
         return ""
     
-    generic_terms = {"the", "and", "company", "reinsurance", "cooperative", "complex", "insurance"}
-    value = value.replace("(", " ").replace(")", " ").strip()
+    value = value.translate(_PAREN_TABLE).strip()
     
     result = ""
     if value.lower().startswith("al") and len(value) > 2:
@@ -82,9 +170,76 @@ def extract_key_words(value: str) -> str:
             final_result += char
     
     words = final_result.split()
-    key_words = [word for word in words if word.lower() not in generic_terms]
+    key_words = [word for word in words if word.lower() not in _GENERIC_TERMS]
     return " ".join(key_words)
 
+def clean_option(dropdown_type: str, option: str) -> str:
+    """Return the part of a dropdown option that is matched against key words.
+
+    Carrier options look like "<code>-<code>-<name>", so only the name is
+    kept; other options just lose their punctuation.
+    """
+    if dropdown_type in ["carrier_type", "carrier"]:
+        parts = option.split("-")
+        if len(parts) >= 3:
+            return "-".join(parts[2:]).strip()
+        elif len(parts) == 2:
+            return parts[1].strip()
+        return option
+    return option.translate(_OPTION_CLEAN_TABLE).strip()
+
+def pick_option(page, dropdown_type: str, dropdown_input_xpath: str, list_id: str, best_match: str) -> str:
+    """Select *best_match* in the dropdown the way a fresh fuzzy match does.
+
+    Carrier options look like "<code>-<code>-<name>": only the name is typed
+    and the exact item is then stepped to, since Kendo's first filtered item
+    need not be the one matched. Other lists take the option typed whole.
+    Returns the selected option, or the typed text if the item wasn't found.
+    """
+    list_xpath = f"//ul[@id='{list_id}']"
+    if dropdown_type in ["carrier_type", "carrier"]:
+        type_value = clean_option(dropdown_type, best_match)
+
+        fill_and_wait_for_filter(page, dropdown_input_xpath, type_value)
+        wait_for_dropdown_options(page, list_xpath, type_value)
+
+        available_options = log_available_options(page, list_xpath)
+        logger.info(f"Options after typing '{type_value}': {available_options}")
+        _remember_options(list_id, available_options)
+
+        # One scan for both the membership test and the position
+        target_index = next((i for i, option in enumerate(available_options) if option == best_match), None)
+        if target_index is not None:
+            logger.info(f"Target option '{best_match}' found at index {target_index}")
+
+            page.click(f'xpath={dropdown_input_xpath}')
+
+            # The input keeps focus, so raw key presses are enough;
+            # Kendo handles back-to-back ArrowDowns without pauses
+            for _ in range(target_index + 1):
+                page.keyboard.press("ArrowDown")
+
+            page.press(f'xpath={dropdown_input_xpath}', "Enter")
+            wait_for_dropdown_closed(page, list_xpath)
+            logger.info(f"Selected {dropdown_type}: '{best_match}' using keyboard navigation")
+            return best_match
+        else:
+            logger.warning(f"'{best_match}' not found in available options after typing '{type_value}': {available_options}")
+            fill_and_wait_for_filter(page, dropdown_input_xpath, type_value)
+            wait_for_dropdown_options(page, list_xpath, type_value)
+            page.press(f'xpath={dropdown_input_xpath}', "Enter")
+            wait_for_dropdown_closed(page, list_xpath)
+            logger.info(f"Selected {dropdown_type}: '{type_value}' using fallback type and enter")
+            return type_value
+    else:
+        type_value = best_match
+        fill_and_wait_for_filter(page, dropdown_input_xpath, type_value)
+        wait_for_dropdown_options(page, list_xpath, type_value)
+        page.press(f'xpath={dropdown_input_xpath}', "Enter")
+        wait_for_dropdown_closed(page, list_xpath)
+        logger.info(f"Selected {dropdown_type}: '{type_value}' from match '{best_match}'")
+        return type_value
+
 def select_or_type_dropdown(page, dropdown_type: str, dropdown_input_xpath: str, list_id: str, value: str, dropdown_arrow_xpath: str = None, timeout: int = 20000) -> str:
     try:
         if not value:
@@ -121,83 +276,80 @@ def select_or_type_dropdown(page, dropdown_type: str, dropdown_input_xpath: str,
 
         if dropdown_type == "carrier_type":
             fallback_xpath = '//input[@name="OrganizationId_input"]'
-            initial_wait = 1000
         elif dropdown_type == "visit_type":
             fallback_xpath = '//input[@name="VisitType_input"]'
-            initial_wait = 2000
         elif dropdown_type == "carrier":
             fallback_xpath = '//input[@name="ContractId_input"]'
-            initial_wait = 1000
         else:
             raise ValueError(f"Unknown dropdown_type: {dropdown_type}")
 
         if find_element_with_fallback(page, dropdown_input_xpath, fallback_xpath):
             page.click(f'xpath={dropdown_input_xpath}')
-            page.wait_for_timeout(initial_wait)
         else:
             logger.error(f"{dropdown_type} input field not found at {dropdown_input_xpath}")
             return key_input
 
+        # An option already picked for these key words in a recent run is
+        # selected directly, skipping the chunk search and fuzzy matching.
+        # pick_option() drives the widget exactly as after a fresh match
+        match_key = f"{list_id}|{key_input}"
+        cached_match = _cache_get(_MATCH_CACHE, match_key)
+        if cached_match:
+            logger.info(f"Using cached {dropdown_type} match for '{key_input}': '{cached_match}'")
+            return pick_option(page, dropdown_type, dropdown_input_xpath, list_id, cached_match)
+
+        # Key words that are exactly one of the options seen before need no
+        # fuzzy search either
+        known_options = _cache_get(_SEEN_OPTIONS, list_id)
+        if known_options:
+            exact_matches = {}
+            for option in known_options:
+                exact_matches.setdefault(clean_option(dropdown_type, option).lower(), option)
+            exact_match = exact_matches.get(key_input.lower())
+            if exact_match:
+                logger.info(f"Exact {dropdown_type} match for '{key_input}': '{exact_match}'")
+                return pick_option(page, dropdown_type, dropdown_input_xpath, list_id, exact_match)
+
         key_words = key_input.split()
         if dropdown_type in ["carrier_type", "carrier"]:
             max_chunk_size = 2
         else:
             max_chunk_size = 3
 
-        paren_chunks = []
-        paren_words = set()
-        paren_matches = re.findall(r'\((.*?)\)', value)
+        # Sub-phrases of any parenthesised part of the value; chunks found
+        # there are tried first within their size group
+        paren_chunks = set()
+        paren_matches = _PAREN_RE.findall(value)
         for match in paren_matches:
             match_words = extract_key_words(match).split()
             for size in range(1, len(match_words) + 1):
                 for i in range(len(match_words) - size + 1):
-                    chunk = " ".join(match_words[i:i + size])
-                    paren_chunks.append(chunk)
-                    if size == 1:
-                        paren_words.add(chunk)
+                    paren_chunks.add(" ".join(match_words[i:i + size]))
 
-        all_chunks = []
-        for size in range(1, max_chunk_size + 1):
+        # Build the chunks in one pass, ordered 2-word, 3-word, then single
+        # words
+        chunks = []
+        for size in (2, 3, 1):
+            if size > max_chunk_size:
+                continue
+            paren_in_size = []
+            other_in_size = []
             for i in range(len(key_words) - size + 1):
                 chunk = " ".join(key_words[i:i + size])
-                all_chunks.append(chunk)
-
-        chunks_by_length = {size: [] for size in range(1, max_chunk_size + 1)}
-        for chunk in all_chunks:
-            length = len(chunk.split())
-            chunks_by_length[length].append(chunk)
-
-        ordered_chunks = []
-        for size in [2, 3, 1]:
-            if size <= max_chunk_size:
-                paren_in_size = [chunk for chunk in chunks_by_length[size] if chunk in paren_chunks]
-                other_in_size = [chunk for chunk in chunks_by_length[size] if chunk not in paren_chunks]
-                ordered_chunks.extend(paren_in_size + other_in_size)
-        
-        for size in range(4, max_chunk_size + 1):
-            if size in chunks_by_length:
-                paren_in_size = [chunk for chunk in chunks_by_length[size] if chunk in paren_chunks]
-                other_in_size = [chunk for chunk in chunks_by_length[size] if chunk not in paren_chunks]
-                ordered_chunks.extend(paren_in_size + other_in_size)
-
-        if 1 in chunks_by_length:
-            paren_single = [chunk for chunk in chunks_by_length[1] if chunk in paren_words]
-            other_single = [chunk for chunk in chunks_by_length[1] if chunk not in paren_words]
-            ordered_chunks = [c for c in ordered_chunks if len(c.split()) != 1] + (paren_single + other_single)
-
-        chunks = ordered_chunks
+                if chunk in paren_chunks:
+                    paren_in_size.append(chunk)
+                else:
+                    other_in_size.append(chunk)
+            chunks.extend(paren_in_size + other_in_size)
         logger.info(f"Text chunks for {dropdown_type}: {chunks}")
 
         list_xpath = f"//ul[@id='{list_id}']"
         for chunk in chunks:
             logger.info(f"Typing chunk: '{chunk}'")
-            page.press(f'xpath={dropdown_input_xpath}', "Control+a")
-            page.press(f'xpath={dropdown_input_xpath}', "Backspace")
-            page.fill(f'xpath={dropdown_input_xpath}', chunk)
-            page.wait_for_timeout(2000)
-
+            # Go on as soon as the list shows options filtered for this chunk
             try:
-                page.wait_for_selector(f'xpath={list_xpath}', state='visible', timeout=timeout)
+                fill_and_wait_for_filter(page, dropdown_input_xpath, chunk)
+                page.wait_for_selector(f'xpath={list_xpath}/li', state='visible', timeout=timeout)
                 break
             except PlaywrightTimeoutError:
                 logger.error(f"{dropdown_type} dropdown {list_xpath} not visible after {timeout}ms with '{chunk}'")
@@ -207,8 +359,7 @@ def select_or_type_dropdown(page, dropdown_type: str, dropdown_input_xpath: str,
 
         if dropdown_type == "referring":
             # Fetch visible options (each item is inside a span.k-cell[2]).
-            options = page.query_selector_all(f'xpath={list_xpath}/li/span[@class="k-cell"][2]')
-            available_options = [option.inner_text().strip() for option in options if option.inner_text().strip()]
+            available_options = option_texts(page, f'{list_xpath}/li/span[@class="k-cell"][2]')
 
             if not available_options:
                 logger.warning(f"No options loaded for referring at {list_xpath}")
@@ -216,9 +367,8 @@ def select_or_type_dropdown(page, dropdown_type: str, dropdown_input_xpath: str,
 
             # Choose the first option in the list for referring.
             page.press(f'xpath={dropdown_input_xpath}', "ArrowDown")
-            page.wait_for_timeout(300)
             page.press(f'xpath={dropdown_input_xpath}', "Enter")
-            page.wait_for_timeout(2000)
+            wait_for_dropdown_closed(page, list_xpath)
             selected_value = available_options[0]
             logger.info(f"Selected referring (first option): '{selected_value}'")
             return selected_value
@@ -229,100 +379,46 @@ def select_or_type_dropdown(page, dropdown_type: str, dropdown_input_xpath: str,
             if not available_options:
                 logger.warning(f"No options loaded for {dropdown_type} at {list_xpath}")
                 return type_and_enter_kendo_dropdown(page, dropdown_input_xpath, key_input)
+            _remember_options(list_id, available_options)
 
-        if dropdown_type in ["carrier_type", "carrier"]:
-            cleaned_options = []
-            for option in available_options:
-                parts = option.split("-")
-                if len(parts) >= 3:
-                    cleaned_option = "-".join(parts[2:]).strip()
-                elif len(parts) == 2:
-                    cleaned_option = parts[1].strip()
-                else:
-                    cleaned_option = option
-                cleaned_options.append(cleaned_option)
-        else:
-            cleaned_options = [opt.replace("-", " ").replace(",", " ").replace("(", " ").replace(")", " ").strip() for opt in available_options]
+        cleaned_options = [clean_option(dropdown_type, opt) for opt in available_options]
         logger.info(f"Cleaned options for fuzzy matching: {cleaned_options}")
 
+        # Score every chunk against every option in one cdist call;
+        # default_process keeps fuzzywuzzy's lowercase/strip-punctuation
+        # preprocessing. argmax picks the first chunk (then option) with the
+        # top score, same as the old per-chunk loop
         best_match_cleaned = None
+        best_match_index = None
         best_score = 0
         best_chunk = None
-        for chunk in chunks:
-            match, score = process.extractOne(chunk, cleaned_options, scorer=fuzz.token_sort_ratio)
-            if score > best_score:
-                best_match_cleaned = match
-                best_score = score
-                best_chunk = chunk
+        # uint8 scores are rounded to whole numbers like fuzzywuzzy's were
+        scores = process.cdist(chunks, cleaned_options, scorer=fuzz.token_sort_ratio, processor=default_process, workers=-1, dtype=np.uint8)
+        chunk_index, option_index = divmod(int(scores.argmax()), scores.shape[1])
+        if scores[chunk_index, option_index] > 0:
+            best_match_index = option_index
+            best_match_cleaned = cleaned_options[best_match_index]
+            best_score = int(scores[chunk_index, option_index])
+            best_chunk = chunks[chunk_index]
         logger.info(f"Best fuzzy match for chunks '{chunks}': '{best_match_cleaned}' with score {best_score} (from chunk '{best_chunk}')")
 
         if best_score >= 60:
-            original_match, original_score = process.extractOne(key_input, cleaned_options, scorer=fuzz.token_sort_ratio)
+            original_match, original_score, original_index = process.extractOne(key_input, cleaned_options, scorer=fuzz.token_sort_ratio, processor=default_process)
             logger.info(f"Double-check with original '{key_input}': '{original_match}' with score {original_score}")
 
             if original_score >= 50:
-                best_match_index = cleaned_options.index(best_match_cleaned)
                 best_match = available_options[best_match_index]
             elif original_score > best_score:
-                best_match_index = cleaned_options.index(original_match)
-                best_match = available_options[best_match_index]
+                best_match = available_options[original_index]
                 logger.info(f"Overriding chunk match with original match '{original_match}' (score {original_score} > {best_score})")
             else:
-                best_match_index = cleaned_options.index(best_match_cleaned)
                 best_match = available_options[best_match_index]
 
-            if dropdown_type in ["carrier_type", "carrier"]:
-                parts = best_match.split("-")
-                if len(parts) >= 3:
-                    type_value = "-".join(parts[2:]).strip()
-                elif len(parts) == 2:
-                    type_value = parts[1].strip()
-                else:
-                    type_value = best_match
-
-                page.press(f'xpath={dropdown_input_xpath}', "Control+a")
-                page.press(f'xpath={dropdown_input_xpath}', "Backspace")
-                page.fill(f'xpath={dropdown_input_xpath}', type_value)
-                page.wait_for_timeout(2000)
-
-                available_options = log_available_options(page, list_xpath)
-                logger.info(f"Options after typing '{type_value}': {available_options}")
-
-                if best_match in available_options:
-                    target_index = available_options.index(best_match)
-                    logger.info(f"Target option '{best_match}' found at index {target_index}")
-                    
-                    page.click(f'xpath={dropdown_input_xpath}')
-                    page.wait_for_timeout(500)
-
-                    for _ in range(target_index + 1):
-                        page.press(f'xpath={dropdown_input_xpath}', "ArrowDown")
-                        page.wait_for_timeout(500)
-                    
-                    page.press(f'xpath={dropdown_input_xpath}', "Enter")
-                    page.wait_for_timeout(2000)
-                    logger.info(f"Selected {dropdown_type}: '{best_match}' using keyboard navigation")
-                    return best_match
-                else:
-                    logger.warning(f"'{best_match}' not found in available options after typing '{type_value}': {available_options}")
-                    page.press(f'xpath={dropdown_input_xpath}', "Control+a")
-                    page.press(f'xpath={dropdown_input_xpath}', "Backspace")
-                    page.fill(f'xpath={dropdown_input_xpath}', type_value)
-                    page.wait_for_timeout(2000)
-                    page.press(f'xpath={dropdown_input_xpath}', "Enter")
-                    page.wait_for_timeout(2000)
-                    logger.info(f"Selected {dropdown_type}: '{type_value}' using fallback type and enter")
-                    return type_value
-            else:
-                type_value = best_match
-                page.press(f'xpath={dropdown_input_xpath}', "Control+a")
-                page.press(f'xpath={dropdown_input_xpath}', "Backspace")
-                page.fill(f'xpath={dropdown_input_xpath}', type_value)
-                page.wait_for_timeout(2000)
-                page.press(f'xpath={dropdown_input_xpath}', "Enter")
-                page.wait_for_timeout(2000)
-                logger.info(f"Selected {dropdown_type}: '{type_value}' from match '{best_match}' (score: {best_score if original_score < 50 or original_score <= best_score else original_score})")
-                return type_value
+            logger.info(f"Matched {dropdown_type} '{best_match}' (score: {best_score if original_score < 50 or original_score <= best_score else original_score})")
+            selected = pick_option(page, dropdown_type, dropdown_input_xpath, list_id, best_match)
+            if selected == best_match:
+                _cache_put(_MATCH_CACHE, match_key, best_match)
+            return selected
         else:
             logger.warning(f"No {dropdown_type} match above threshold 60 for '{chunks}' (best: '{best_match_cleaned}', score: {best_score})")
             return type_and_enter_kendo_dropdown(page, dropdown_input_xpath, key_input)
@@ -351,21 +447,82 @@ def find_element_with_fallback(page, primary_xpath: str, fallback_selector: str,
             logger.error(f"Fallback selector {fallback_selector} also not found.")
             return False
 
+def option_texts(page, options_xpath: str) -> list:
+    """Return the non-empty, trimmed texts of the elements at *options_xpath*.
+
+    The texts are collected inside the browser in a single call rather than
+    one inner_text() round trip per option.
+    """
+    return page.eval_on_selector_all(
+        f'xpath={options_xpath}',
+        "els => els.map(e => e.innerText.trim()).filter(Boolean)"
+    )
+
 def log_available_options(page, list_xpath: str, has_nested_span_p: bool = False, timeout: int = 10000) -> list:
     try:
         page.wait_for_selector(f'xpath={list_xpath}', state='visible', timeout=timeout)
-        if has_nested_span_p:
-            options = page.query_selector_all(f'xpath={list_xpath}/li/span/p')
-            available_options = [option.inner_text().strip() for option in options if option.inner_text().strip()]
-        else:
-            options = page.query_selector_all(f'xpath={list_xpath}/li')
-            available_options = [option.inner_text().strip() for option in options if option.inner_text().strip()]
+        available_options = option_texts(page, f'{list_xpath}/li/span/p' if has_nested_span_p else f'{list_xpath}/li')
         logger.info(f"Available options in dropdown at {list_xpath}: {available_options}")
         return available_options
     except Exception as e:
         logger.error(f"Failed to log available options at {list_xpath}: {str(e)}", exc_info=True)
         return []
 
+def wait_for_dropdown_options(page, list_xpath: str, text: str = None, timeout: int = 5000) -> bool:
+    """Wait until the dropdown list shows an option (one containing *text*, if given)."""
+    options = page.locator(f'xpath={list_xpath}/li', has_text=text)
+    try:
+        options.first.wait_for(state='visible', timeout=timeout)
+        return True
+    except PlaywrightTimeoutError:
+        logger.warning(f"No options{f' matching {text!r}' if text else ''} appeared in {list_xpath} within {timeout}ms")
+        return False
+
+def wait_for_ajax_idle(page, timeout: int = 10000) -> bool:
+    """Wait until jQuery (which the Kendo widgets use) has no AJAX requests in flight.
+
+    Same check as endpoint_upload.wait_for_ajax_idle; that module exits on
+    import without its own settings, so it can't be imported here.
+    """
+    try:
+        page.wait_for_function("() => !window.jQuery || window.jQuery.active === 0", timeout=timeout)
+        return True
+    except PlaywrightTimeoutError:
+        logger.warning(f"AJAX requests still pending after {timeout} ms")
+        return False
+
+def fill_and_wait_for_filter(page, input_xpath: str, text: str, timeout: int = 5000) -> bool:
+    """Fill *text* into a Kendo input and wait for the list to be re-filtered.
+
+    Right after the fill the list still shows the previous results, which
+    may already contain *text*, so waiting on the list alone can read a
+    stale list. Wait for the filter request instead, then for jQuery to
+    finish handling it (its success callback renders the new items).
+    Returns False when no filter request was seen.
+    """
+    filled = False
+    try:
+        with page.expect_response(lambda r: r.request.resource_type in ("xhr", "fetch"), timeout=timeout):
+            page.fill(f'xpath={input_xpath}', text)
+            filled = True
+    except PlaywrightTimeoutError:
+        if not filled:
+            raise
+        # No request: the list filters client-side and has long been redrawn
+        logger.warning(f"No filter request seen for {text!r} within {timeout}ms")
+        return False
+    wait_for_ajax_idle(page, timeout=timeout)
+    return True
+
+def wait_for_dropdown_closed(page, list_xpath: str, timeout: int = 5000) -> bool:
+    """Wait until the dropdown list has closed after a selection."""
+    try:
+        page.wait_for_selector(f'xpath={list_xpath}', state='hidden', timeout=timeout)
+        return True
+    except PlaywrightTimeoutError:
+        logger.warning(f"Dropdown {list_xpath} still open after {timeout}ms")
+        return False
+
 def retry_operation(page, action, max_attempts, value, xpath, timeout=2000):
     for attempt in range(max_attempts):
         try:
@@ -382,31 +539,40 @@ def select_kendo_dropdown_by_arrow(page, dropdown_arrow_xpath: str, list_id: str
         if not value:
             logger.warning(f"No value provided for Kendo dropdown at {dropdown_arrow_xpath}")
             return ""
+        cached_options = _cache_get(_OPTIONS_CACHE, list_id)
         if find_element_with_fallback(page, dropdown_arrow_xpath, f'//span[contains(@class, "k-select")]'):
             page.click(f'xpath={dropdown_arrow_xpath}')
-            page.wait_for_timeout(1000)
-            page.wait_for_timeout(5000)
         else:
             logger.error(f"Arrow button not found at {dropdown_arrow_xpath}")
             return ""
         list_xpath = f"//ul[@id='{list_id}']"
         page.wait_for_selector(f'xpath={list_xpath}', state='visible', timeout=timeout)
-        available_options = log_available_options(page, list_xpath, has_nested_span_p)
-        if value not in available_options:
-            logger.warning(f"Value '{value}' not found in dropdown options: {available_options}")
-            return ""
+        if cached_options is None or value not in cached_options:
+            # A miss only means the cached list may be stale: scrape it again
+            if cached_options is not None:
+                logger.info(f"Value '{value}' not in cached options for {list_id}, re-scraping")
+                _OPTIONS_CACHE.pop(list_id, None)
+            wait_for_dropdown_options(page, list_xpath)
+            available_options = log_available_options(page, list_xpath, has_nested_span_p)
+            if available_options:
+                _cache_put(_OPTIONS_CACHE, list_id, available_options)
+            if value not in available_options:
+                logger.warning(f"Value '{value}' not found in dropdown options: {available_options}")
+                return ""
         option_xpath = f"{list_xpath}/li[span/p[text()='{value}']]" if has_nested_span_p else f"{list_xpath}/li[text()='{value}']"
         option_element = page.wait_for_selector(f'xpath={option_xpath}', state='visible', timeout=timeout)
         option_element.scroll_into_view_if_needed()
-        page.wait_for_timeout(1000)
         page.click(f'xpath={option_xpath}')
-        page.wait_for_timeout(1000)
-        page.wait_for_timeout(3000)
+        wait_for_dropdown_closed(page, list_xpath)
         logger.info(f"Selected {value} in Kendo dropdown at {dropdown_arrow_xpath}")
         return value
 
     return retry_operation(page, select_action, max_attempts=5, value=value, xpath=dropdown_arrow_xpath)
 
+def _owned_list_xpath(input_xpath: str) -> str:
+    """XPath of the Kendo list box that *input_xpath* opens."""
+    return f"//ul[@id=({input_xpath}/@aria-owns | {input_xpath}/@aria-controls)]"
+
 def type_and_enter_kendo_dropdown(page, dropdown_input_xpath: str, value: str, timeout: int = 10000) -> str:
     def type_action():
         if not value:
@@ -414,17 +580,15 @@ def type_and_enter_kendo_dropdown(page, dropdown_input_xpath: str, value: str, t
             return ""
         if find_element_with_fallback(page, dropdown_input_xpath, f'//input[@name="{value}_input"]'):
             page.click(f'xpath={dropdown_input_xpath}')
-            page.wait_for_timeout(2000)
-            page.press(f'xpath={dropdown_input_xpath}', "Control+a")
-            page.wait_for_timeout(500)
-            page.press(f'xpath={dropdown_input_xpath}', "Backspace")
-            page.wait_for_timeout(500)
-            page.fill(f'xpath={dropdown_input_xpath}', value)
-            page.wait_for_timeout(1000)
+            # Kendo links the input to its list through aria-owns/aria-controls
+            fill_and_wait_for_filter(page, dropdown_input_xpath, value, timeout=2000)
+            wait_for_dropdown_options(page, _owned_list_xpath(dropdown_input_xpath), value, timeout=2000)
             page.press(f'xpath={dropdown_input_xpath}', "Enter")
             page.wait_for_timeout(300)                 # short pause
             page.press(f'xpath={dropdown_input_xpath}', "Tab")
-            page.wait_for_timeout(5000)
+            # networkidle is already reached once the page has loaded; wait
+            # for the AJAX the selection itself triggers
+            wait_for_ajax_idle(page, timeout=timeout)
             logger.info(f"Typed and entered {value} in Kendo dropdown at {dropdown_input_xpath}")
             return value
         else:
@@ -448,25 +612,22 @@ def set_date_of_birth(page, input_xpath: str, target_date: str, timeout: int = 1
             logger.error(f"Date of Birth input not found at {input_xpath}")
             return False
 
+        # Each segment of the masked date input is typed in one call; the
+        # keystrokes still go through so Kendo's mask picks them up
+        date_input = page.locator(f'xpath={input_xpath}')
         page.click(f'xpath={input_xpath}', position={"x": 5, "y": 5})
         page.wait_for_timeout(2000)
-        for char in target_month:
-            page.type(f'xpath={input_xpath}', char)
-            page.wait_for_timeout(200)
+        date_input.press_sequentially(target_month)
         page.wait_for_timeout(2000)
 
         page.click(f'xpath={input_xpath}', position={"x": 30, "y": 5})
         page.wait_for_timeout(2000)
-        for char in target_day:
-            page.type(f'xpath={input_xpath}', char)
-            page.wait_for_timeout(200)
+        date_input.press_sequentially(target_day)
         page.wait_for_timeout(2000)
 
         page.click(f'xpath={input_xpath}', position={"x": 60, "y": 5})
         page.wait_for_timeout(2000)
-        for char in target_year:
-            page.type(f'xpath={input_xpath}', char)
-            page.wait_for_timeout(200)
+        date_input.press_sequentially(target_year)
         page.wait_for_timeout(2000)
 
         logger.info(f"Set Date of Birth to {target_date}")
@@ -491,9 +652,7 @@ def input_icd10_codes(page, input_xpath: str, codes: list, timeout: int = 10000)
                 if " " in icd10_code:
                     icd10_code = icd10_code.split(" ")[0].strip()
                 
-                for char in icd10_code:
-                    page.type(f'xpath={input_xpath}', char)
-                    page.wait_for_timeout(200)
+                page.locator(f'xpath={input_xpath}').press_sequentially(icd10_code)
                 page.wait_for_timeout(4000)
                 page.press(f'xpath={input_xpath}', "Enter")
                 page.wait_for_timeout(1000)
@@ -982,6 +1141,7 @@ def main():
         # /upload endpoint in *api.py* which also triggered this script.
         # ------------------------------------------------------------------
         json_file, pdf_file = get_latest_files(MICLINIC_UPLOAD_DIR)
+        load_dropdown_cache()
 
         if not json_file:
             logger.error("No JSON file found in uploads directory.")
@@ -1147,8 +1307,17 @@ def main():
         with sync_playwright() as p:
             try:
                 browser = Browser(config=config)
-                playwright_browser = p.chromium.launch(headless=config.headless)
-                page = playwright_browser.new_page()
+                if BROWSER_CDP_URL:
+                    # Attach to a browser that stays up between runs
+                    playwright_browser = p.chromium.connect_over_cdp(BROWSER_CDP_URL)
+                    context = playwright_browser.contexts[0] if playwright_browser.contexts else playwright_browser.new_context()
+                    page = context.new_page()
+                else:
+                    # A persistent profile keeps the site's cached scripts,
+                    # styles and session cookies from earlier runs
+                    playwright_browser = p.chromium.launch_persistent_context(BROWSER_PROFILE_DIR, headless=config.headless)
+                    page = playwright_browser.pages[0] if playwright_browser.pages else playwright_browser.new_page()
+                block_unneeded_resources(page)
                 logger.info("Browser launched successfully.")
                 print("Browser launched successfully.")
             except Exception as e:
@@ -1163,6 +1332,11 @@ def main():
                     print(f"Attempting login (Attempt {attempt + 1}/{max_attempts})")
                     page.goto("http://77.30.174.26/MILLENSYS/MiClinic/Account/LogOn", timeout=80000)
                     page.wait_for_load_state('networkidle', timeout=80000)
+                    if page.url.startswith("http://77.30.174.26/MILLENSYS/MiClinic/CommonPages/PatientPanel"):
+                        # The profile's session is still valid
+                        logger.info("Already logged in.")
+                        print("Already logged in.")
+                        break
                     page.fill('//input[@id="username"]', sensitive_data["username"])
                     page.wait_for_timeout(1000)
                     page.fill('//input[@id="password"]', sensitive_data["password"])
@@ -1247,7 +1421,11 @@ def main():
                 logger.error(f"Failed to fill form: {str(e)}", exc_info=True)
                 print(f"Error: Failed to fill form: {str(e)}")
                 raise
+            save_dropdown_cache()
             try:
+                if BROWSER_CDP_URL:
+                    # Leave the shared browser running, just drop our tab
+                    page.close()
                 playwright_browser.close()
                 logger.info("Browser closed successfully.")
                 print("Browser closed successfully.")
@@ -1257,11 +1435,12 @@ def main():
 
             # ------------------------------------------------------------------
             # Archive the processed files so they won't be picked up again on the
-            # next run.  We call the same helper used by FastAPI.
+            # next run.  This is the blocking twin of the FastAPI cleanup task;
+            # calling that coroutine here would never run it.
             # ------------------------------------------------------------------
             try:
                 paths_to_archive = [Path(p) for p in [json_file, pdf_file] if p]
-                _cleanup_after_send(paths_to_archive)
+                archive_sent_files(paths_to_archive)
             except Exception as exc:
                 logger.error(f"Failed to archive processed files: {exc}")
 
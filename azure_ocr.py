@@ -9,6 +9,7 @@ from PIL import Image
 import numpy as np
 from dotenv import load_dotenv
 import os, logging, json
+import functools
 import requests
 from openai import OpenAI
 
@@ -20,61 +21,67 @@ SUBSCRIPTION_KEY = os.getenv("AZURE_KEY")
 ENDPOINT = os.getenv("AZURE_ENDPOINT")
 REGION = os.getenv("AZURE_REGION")
 
+# Delay bounds (seconds) between polls of an Azure Read operation
+READ_POLL_INITIAL_DELAY = 0.25
+READ_POLL_MAX_DELAY = 4.0
+
+# 256-entry threshold table: pixels above 70 become white, the rest black
+_BINARIZE_LUT = [0] * 71 + [255] * (256 - 71)
+
+
 def load_image(filename: str) -> Image:
     image = Image.open(filename)
     # Convert Image to Grayscale
     image = image.convert("L")
-    # Apply threshold on Image
-    image = image.point(lambda p: 255 if p > 70 else 0)
+    # Apply threshold on Image via a lookup table (handled in PIL's C core)
+    image = image.point(_BINARIZE_LUT)
     return image
 
 
 def load_image_cv2(filename: str):
-    image = cv2.imread(filename)
-    # cv2.cvtColor is applied over the image input with applied parameters
-    # to convert the image in grayscale
-    image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    # Applying Otsu thresholding as an extra flag in binary thresholding
-    ret, thresh = cv2.threshold(image, 120, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    # Decode straight to grayscale so the image is never expanded to BGR
+    image = cv2.imread(filename, cv2.IMREAD_GRAYSCALE)
+    # Applying Otsu thresholding (which picks the threshold itself) in place
+    ret, thresh = cv2.threshold(image, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU, dst=image)
     return thresh
 
 
 def group_lines(ocr_results, use_paddle=False):
-    lines = []
-    heights = []
-
-    for box in ocr_results:
-        coords = box[0]
-        y_min = min(int(coords[0][1]), int(coords[1][1]))  # Top Y-coordinate
-        y_max = max(int(coords[2][1]), int(coords[3][1]))  # Bottom Y-coordinate
-        text = box[1] if not use_paddle else box[1][0]
-        height = y_max - y_min  # Height of the box
-        heights.append(height)
-        lines.append({"y_min": y_min, "y_max": y_max, "text": text})
-
-    avg_height = np.mean(heights)
+    if not ocr_results:
+        return ""
+
+    # Box corners as a single (N, 4, 2) array, truncated to ints
+    coords = np.asarray([box[0] for box in ocr_results], dtype=np.float64).astype(np.int32)
+    y_min = np.minimum(coords[:, 0, 1], coords[:, 1, 1])  # Top Y-coordinate
+    y_max = np.maximum(coords[:, 2, 1], coords[:, 3, 1])  # Bottom Y-coordinate
+
+    avg_height = (y_max - y_min).mean()
     dynamic_threshold = avg_height * 0.8  # Adjust the multiplier as needed
 
-    # Sort lines by their Y-coordinates
-    lines.sort(key=lambda x: x["y_min"])
+    # Sort lines by their Y-coordinates (stable, so ties keep OCR order)
+    order = np.argsort(y_min, kind="stable")
+    texts = [
+        ocr_results[i][1] if not use_paddle else ocr_results[i][1][0]
+        for i in order.tolist()
+    ]
+    y_min_sorted = y_min[order].tolist()
+    y_max_sorted = y_max[order].tolist()
 
     # Group lines based on overlapping Y-coordinates
     grouped_lines = []
-    current_group = [lines[0]["text"]]
-    current_y_range = [lines[0]["y_min"], lines[0]["y_max"]]
-
-    for line in lines[1:]:
-        y_min, y_max = line["y_min"], line["y_max"]
+    current_group = [texts[0]]
+    current_y_max = y_max_sorted[0]
 
+    for text, line_y_min, line_y_max in zip(texts[1:], y_min_sorted[1:], y_max_sorted[1:]):
         # Check if the line overlaps with the current group
-        if current_y_range[1] - y_min >= dynamic_threshold:
-            current_group.append(line["text"])
-            current_y_range[1] = max(current_y_range[1], y_max)
+        if current_y_max - line_y_min >= dynamic_threshold:
+            current_group.append(text)
+            current_y_max = max(current_y_max, line_y_max)
         else:
             # Start a new group
             grouped_lines.append(" ".join(current_group))
-            current_group = [line["text"]]
-            current_y_range = [y_min, y_max]
+            current_group = [text]
+            current_y_max = line_y_max
 
     # Append the last group
     grouped_lines.append(" ".join(current_group))
@@ -83,6 +90,30 @@ def group_lines(ocr_results, use_paddle=False):
 
 
 
+@functools.lru_cache(maxsize=1)
+def get_computervision_client() -> ComputerVisionClient:
+    """Return the process-wide Azure Computer Vision client.
+
+    The client is built once and kept alive, so every OCR call reuses the
+    same HTTP session (msrest keeps one per thread) instead of paying a new
+    TLS handshake per page.
+    """
+    client = ComputerVisionClient(
+        ENDPOINT, CognitiveServicesCredentials(SUBSCRIPTION_KEY)
+    )
+    client.config.keep_alive = True
+    return client
+
+
+def warm_up() -> None:
+    """Build the shared Azure client.
+
+    Meant to run once at service startup so the first request does not pay
+    for client construction.
+    """
+    get_computervision_client()
+
+
 class Inferencer:
     """A class representing OCR inference."""
 
@@ -91,9 +122,7 @@ class Inferencer:
 
         self.langs = ["en", "ar"]
 
-        self.computervision_client = ComputerVisionClient(
-            ENDPOINT, CognitiveServicesCredentials(SUBSCRIPTION_KEY)
-        )
+        self.computervision_client = get_computervision_client()
 
     def run_azure_ocr(self, filename: str):
         """
@@ -101,7 +130,7 @@ class Inferencer:
         :param filename: The filename of the image
         :param card: ID card to run post processing accordingly
         """
-        print("Running azure OCR!")
+        logger.debug("Running azure OCR on %s", filename)
         # Open the image
         read_image = open(filename, "rb")
         # Call API with image and raw response (allows you to get the operation location)
@@ -116,16 +145,19 @@ class Inferencer:
         read_operation_location = read_response.headers["Operation-Location"]
         # Take the ID off and use to get results
         operation_id = read_operation_location.split("/")[-1]
-        # Call the "GET" API and wait for the retrieval of the results
+        # Call the "GET" API and wait for the retrieval of the results,
+        # backing off exponentially so fast pages return quickly
+        delay = READ_POLL_INITIAL_DELAY
         while True:
             read_result = self.computervision_client.get_read_result(operation_id)
             if read_result.status.lower() not in ["notstarted", "running"]:
                 break
-            print("Waiting for result...")
-            time.sleep(10)
+            logger.debug("Waiting %.2fs for Azure read result...", delay)
+            time.sleep(delay)
+            delay = min(delay * 2, READ_POLL_MAX_DELAY)
 
         # Print the detected text, line by line
-        ocr_reults = []
+        ocr_results = []
         if read_result.status == OperationStatusCodes.succeeded:
             for text_result in read_result.analyze_result.read_results:
                 for line in text_result.lines:
@@ -134,10 +166,11 @@ class Inferencer:
                         # Preserve the original text without any modification
                         # This will keep Arabic text intact
                         line_words.append(word.text)
-                    ocr_reults.append(line_words)
+                    ocr_results.append(line_words)
         read_image.close()
-        print(ocr_reults)
-        return ocr_reults
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Azure OCR results for %s: %s", filename, ocr_results)
+        return ocr_results
     
 
     def run_inference(self, filename: str):
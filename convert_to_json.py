@@ -1,40 +1,126 @@
-import json
+import asyncio
+import copy
+import hashlib
+import logging
+import mmap
 import os
 import re
-from openai import OpenAI
+import sys
+import threading
+import httpx
+import numpy as np
+import orjson
+from bisect import bisect_right
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import lru_cache
+from pathlib import Path
+from openai import AsyncOpenAI, OpenAI
+try:
+    import re2 as _marker_re
+except ImportError:  # google-re2 is optional; the stdlib engine is used when it's missing
+    _marker_re = re
 from dotenv import load_dotenv
+from pydantic import TypeAdapter
 from prompt import MAIN_PROMPT
-from models import StructuredOCR, Language, MedicalFormContent
-from typing import Dict, Any, List, Optional, Tuple
+from models import Language, MedicalFormContent
+from typing import Dict, Any, Iterable, List, Optional, Tuple
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 api_key = os.getenv("OPENAI_API_KEY")
 
-client = OpenAI(api_key=api_key)
+# Pooled keep-alive connections sized for convert_to_json_batch, so
+# concurrent requests reuse TLS connections instead of queueing or
+# re-handshaking
+_HTTP_LIMITS = httpx.Limits(max_connections=64, max_keepalive_connections=32)
+
+client = OpenAI(api_key=api_key, http_client=httpx.Client(limits=_HTTP_LIMITS))
+aclient = AsyncOpenAI(api_key=api_key, http_client=httpx.AsyncClient(limits=_HTTP_LIMITS))
+
+# Fields that should be treated as checkboxes
+CHECKBOX_FIELDS = [
+    "single", "married", "newVisit", "followUp", "refill", "walkIn", 
+    "inpatient", "outpatient", "emergencyCase", "chronic", "congenital", "rta",
+    "workRelated", "vaccination", "checkUp", "psychiatric", "infertility", "pregnancy",
+    "approved", "notApproved"
+]
+
+_CHECKBOX_FIELD_SET = frozenset(field.lower() for field in CHECKBOX_FIELDS)
+
+# Precompiled regex patterns (compiled once at import instead of per call)
+_CHECKBOX_YES_NO_RES = {
+    # Pattern like "Referral: Yes" or "Referral Yes"
+    field: re.compile(rf"\b{field}:?\s+(Yes|No)\b", re.IGNORECASE)
+    for field in CHECKBOX_FIELDS
+}
+_PAREN_RE = re.compile(r'\((.*?)\)')
+_WORD_RE = re.compile(r'\S+')
+_KEY_RE = re.compile(r'\b(Name|ID|No|Date|Status|Type|Sex|Age|Class)\s+(?!:)')
+_BOOL_RE = re.compile(r'\b(true|false)\b', re.IGNORECASE)
+_TOKEN_TABLE = str.maketrans({"'": None, '"': None, ",": " "})
+_WS_RE = re.compile(r"\s+")
+# Service table columns parsed as floats
+_NUMERIC_FIELDS = frozenset({
+    'reqQty', 'reqCost', 'grossAmount',
+    'appQty', 'appCost', 'appGross'
+})
+_CODE_SERVICE_RE = re.compile(r"\(([^)]+)\)\s*(.*)", re.IGNORECASE)
+_PAYER_SPLIT_RE = re.compile(r'payer\s*:', re.IGNORECASE)
+_PRIMARY_CODE_RE = re.compile(r'\((\d+[^)]*-\d+[^)]*)\)')
+# Either a primary "(90911-00-00)" or an additional "(12345)" code; the
+# captured code contains a '-' only for the primary shape
+_CODE_ANY_RE = re.compile(r'\((\d+(?:[^)]*-\d+[^)]*)?)\)')
+_NUMBER_RE = re.compile(r'^\d+\.?\d*$')
+_BRACKET_CONTENT_RE = re.compile(r'\[(.*?)\]')
+_QUOTED_WORD_RE = re.compile(r'\'([^\']+)\'')
+# OCR often splits a word before its suffix ("Mammogra phy"); this
+# rejoins the common medical suffixes in one pass
+_SUFFIX_RE = re.compile(r'(\w+)\s+(um|er|ing|ed|al|sis|tion|phy|gram)\b')
+_DESC_PUNCT_RE = re.compile(r'[\[\]\'\",]')
+_DESC_TAIL_RE = re.compile(r'(?:```|\s+Date|\s+---).*$')
+# Phrases that mark a free-text payer message
+PAYER_MESSAGE_MARKERS = [
+    "please note", "amount of", "requested services", "do not require",
+    "prior approval", "policy's terms", "kindly provide", "necessary medical services"
+]
+# Sections that follow the service table
+TABLE_END_MARKERS = [
+    'no data to be shown',
+    'in case management',
+    'i hereby',
+    'medication',
+    'completed/coded',
+    'providers approval',
+]
+# Unwanted parts that might appear in service descriptions
+UNWANTED_DESCRIPTION_SECTIONS = [
+    # Service Provider & Staff sections
+    "services Providers", "Providers Approval", "Approval/Coding", "Staff must", "review/code",
+    "completethe following", "Completed/Coded", "Signature", "Date", "Medication",
+    # Form elements that aren't part of description
+    "Type Req", "Req. Qty", "Req. Cost", "Gross amount", "App. Qty", "App. Cost", "App. Gross", "Note",
+    # Additional unwanted parts that might be present
+    "Providers", "Staff", "Generic", "Signature", "Coded By"
+]
+# The literal marker alternations run on RE2's linear-time engine when
+# google-re2 is installed
+_PAYER_MESSAGE_RE = _marker_re.compile('|'.join(map(re.escape, PAYER_MESSAGE_MARKERS)))
+_TABLE_END_RE = _marker_re.compile('|'.join(map(re.escape, TABLE_END_MARKERS)))
+_CUTOFF_RE = _marker_re.compile('|'.join(map(re.escape, UNWANTED_DESCRIPTION_SECTIONS)))
+# Drop single quotes, turn commas into spaces
+_OCR_CLEAN_TABLE = str.maketrans({"'": None, ",": " "})
 
 def clean_ocr_text(text: str) -> str:
     """Remove single quotes and commas from OCR text while preserving other punctuation."""
-    # Split the text into lines
-    lines = text.split('\n')
-    cleaned_lines = []
-    
-    for line in lines:
-        if line.startswith('[') and line.endswith(']'):
-            # Remove quotes and commas only within square brackets
-            inner_text = line[1:-1]  # Remove outer square brackets
-            # Remove single quotes and commas, but preserve hyphens and colons
-            cleaned_inner = inner_text.replace("'", "").replace(",", " ")
-            cleaned_line = f"[{cleaned_inner}]"
-        else:
-            # For lines without square brackets, just remove quotes and commas
-            cleaned_line = line.replace("'", "").replace(",", " ")
-        cleaned_lines.append(cleaned_line)
-    
-    return '\n'.join(cleaned_lines)
+    # Bracketed and plain lines get the same treatment, so a single
+    # translate over the whole text is enough
+    return text.translate(_OCR_CLEAN_TABLE)
 
-def process_checkboxes(text: str) -> str:
-    """Process checkbox notation in the text.
+def process_checkbox_line(line: str) -> str:
+    """Process checkbox notation in one line of OCR text.
     Handle both:
     1. Parenthesis-based checkboxes:
        - Empty -> false
@@ -44,95 +130,151 @@ def process_checkboxes(text: str) -> str:
        - "Yes" -> true
        - "No" -> false
     """
-    # List of fields that should be treated as checkboxes
-    checkbox_fields = [
-        "single", "married", "newVisit", "followUp", "refill", "walkIn", 
-        "inpatient", "outpatient", "emergencyCase", "chronic", "congenital", "rta",
-        "workRelated", "vaccination", "checkUp", "psychiatric", "infertility", "pregnancy",
-        "approved", "notApproved"
-    ]
-    
-    def process_line(line: str) -> str:
-        # First handle explicit Yes/No values
-        for field in checkbox_fields:
-            # Look for pattern like "Referral: Yes" or "Referral Yes"
-            pattern = rf"\b{field}:?\s+(Yes|No)\b"
-            match = re.search(pattern, line, re.IGNORECASE)
-            if match:
-                value = match.group(1).lower() == "yes"
-                return line.replace(match.group(0), f"{field}: {str(value).lower()}")
+    # First handle explicit Yes/No values
+    for field, pattern in _CHECKBOX_YES_NO_RES.items():
+        match = pattern.search(line)
+        if match:
+            value = match.group(1).lower() == "yes"
+            return line.replace(match.group(0), f"{field}: {str(value).lower()}")
+
+    if '(' not in line:
+        return line
+
+    # Then handle parenthesis-based checkboxes. The line's words are
+    # located once; each match then looks at the (up to) three words
+    # before it, cutting a word the parenthesis is glued to
+    word_starts: List[int] = []
+    word_ends: List[int] = []
+    words_lower: List[str] = []
+    for word in _WORD_RE.finditer(line):
+        word_starts.append(word.start())
+        word_ends.append(word.end())
+        words_lower.append(word.group().lower())
+
+    def checkbox_replacement(match):
+        content = match.group(1).strip()
+        # Get some context before the parenthesis
+        start = match.start()
+        idx = bisect_right(word_ends, start)
+        if idx < len(word_starts) and word_starts[idx] < start:
+            pre_context = words_lower[max(0, idx - 2):idx]
+            pre_context.append(line[word_starts[idx]:start].lower())
+        else:
+            pre_context = words_lower[max(0, idx - 3):idx]
+
+        # Check if any of the preceding words match our checkbox fields
+        is_checkbox_field = not _CHECKBOX_FIELD_SET.isdisjoint(pre_context)
+
+        if is_checkbox_field:
+            if not content:
+                return "false"
+            elif len(content) == 1:
+                return "true"
+
+        return f"({content})"
+
+    return _PAREN_RE.sub(checkbox_replacement, line)
+
+def process_checkboxes(text: str) -> str:
+    """Apply :func:`process_checkbox_line` to every line of *text*."""
+    return '\n'.join(map(process_checkbox_line, text.split('\n')))
+
+def format_key_value_line(line: str) -> str:
+    """Format the key-value pairs of one OCR line consistently."""
+    if line.startswith('[') and line.endswith(']'):
+        # Handle pharmacy-style hyphen separation
+        if 'PHARMACY-' in line or 'PHARMACY -' in line:
+            line = line.replace('PHARMACY-', 'PHARMACY:')
         
-        # Then handle parenthesis-based checkboxes
-        def checkbox_replacement(match):
-            content = match.group(1).strip()
-            # Get some context before the parenthesis
-            pre_context = line[:match.start()].split()[-3:] if match.start() > 0 else []
-            
-            # Check if any of the preceding words match our checkbox fields
-            is_checkbox_field = any(field.lower() in [word.lower() for word in pre_context] 
-                                  for field in checkbox_fields)
-            
-            if is_checkbox_field:
-                if not content:
-                    return "false"
-                elif len(content) == 1:
-                    return "true"
-            
-            return f"({content})"
+        # Ensure key-value separation is consistent
+        # Replace missing colons after known keys
+        line = _KEY_RE.sub(r'\1: ', line)
         
-        return re.sub(r'\((.*?)\)', checkbox_replacement, line)
+        # Handle multiple key-value pairs in same brackets
+        if ' & ' in line:
+            line = line.replace(' & ', '\n')
+        
+        # Handle Yes/No values that might have been converted to true/false
+        line = _BOOL_RE.sub(lambda m: m.group(0).lower(), line)
     
-    # Process each line separately
-    lines = text.split('\n')
-    processed_lines = [process_line(line) for line in lines]
-    return '\n'.join(processed_lines)
+    return line
 
 def format_key_values(text: str) -> str:
     """Format key-value pairs consistently."""
-    lines = text.split('\n')
-    formatted_lines = []
-    
-    for line in lines:
-        if line.startswith('[') and line.endswith(']'):
-            # Handle pharmacy-style hyphen separation
-            if 'PHARMACY-' in line or 'PHARMACY -' in line:
-                line = line.replace('PHARMACY-', 'PHARMACY:')
-            
-            # Ensure key-value separation is consistent
-            # Replace missing colons after known keys
-            line = re.sub(r'\b(Name|ID|No|Date|Status|Type|Sex|Age|Class)\s+(?!:)', r'\1: ', line)
-            
-            # Handle multiple key-value pairs in same brackets
-            if ' & ' in line:
-                line = line.replace(' & ', '\n')
-            
-            # Handle Yes/No values that might have been converted to true/false
-            line = re.sub(r'\b(true|false)\b', lambda m: m.group(0).lower(), line, flags=re.IGNORECASE)
-        
-        formatted_lines.append(line)
-    
-    return '\n'.join(formatted_lines)
+    return '\n'.join(map(format_key_value_line, text.split('\n')))
 
 def read_markdown_file(file_path):
     """Read the content of a markdown file."""
-    with open(file_path, 'r', encoding='utf-8') as file:
-        return file.read()
+    # One binary read and a single decode; newlines are normalised the way
+    # text mode would, but only when the file actually contains '\r'
+    content = Path(file_path).read_bytes().decode('utf-8')
+    if '\r' in content:
+        content = content.replace('\r\n', '\n').replace('\r', '\n')
+    return content
 
 def extract_ocr_text(markdown_content):
     """Extract the OCR text from markdown content."""
-    # Find the text between the first ``` and the last ```
-    start = markdown_content.find('```\n') + 4
-    end = markdown_content.rfind('\n```')
-    if start > 3 and end > 0:
-        return markdown_content[start:end]
+    # Find the text between the first ``` and the last ```; two plain
+    # substring scans instead of a backtracking DOTALL regex
+    start = markdown_content.find("```\n")
+    if start != -1:
+        end = markdown_content.rfind("\n```")
+        if end >= start + 4:
+            return markdown_content[start + 4:end]
     return ""
 
+def read_ocr_text(file_path) -> str:
+    """Read a markdown file and return only its OCR text.
+
+    Same result as ``extract_ocr_text(read_markdown_file(file_path))``, but
+    the fences are located on a memory map of the file so only the text
+    between them is decoded.
+    """
+    with open(file_path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return ""
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            # '\r' line endings need the full normalising read
+            if mm.find(b'\r') == -1:
+                start = mm.find(b"```\n")
+                if start == -1:
+                    return ""
+                end = mm.rfind(b"\n```")
+                if end < start + 4:
+                    return ""
+                return mm[start + 4:end].decode('utf-8')
+    return extract_ocr_text(read_markdown_file(file_path))
+
+def preprocess_ocr_lines(lines: List[str]) -> List[str]:
+    """Apply all preprocessing steps to already split OCR lines.
+
+    Every step works line by line, so they run in one pass over the list.
+    A formatted line may itself contain newlines (split ``&`` pairs).
+    """
+    return [
+        format_key_value_line(process_checkbox_line(line.translate(_OCR_CLEAN_TABLE)))
+        for line in lines
+    ]
+
 def preprocess_ocr_text(ocr_text: str) -> str:
     """Apply all preprocessing steps to OCR text."""
-    text = clean_ocr_text(ocr_text)
-    text = process_checkboxes(text)
-    text = format_key_values(text)
-    return text
+    return '\n'.join(preprocess_ocr_lines(ocr_text.split('\n')))
+
+def _parse_float(value: str) -> Optional[float]:
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+@lru_cache(maxsize=2048)
+def clean_token(token: str) -> str:
+    """Normalise a raw markdown line for easier matching."""
+    # Remove leading/trailing square brackets and any leftover braces
+    token = token.strip().lstrip("[").rstrip("]")
+    if len(token) >= 2 and token[0] == "{" and token[-1] == "}":
+        token = token[1:-1]
+    # Drop quotes, commas → spaces, collapse whitespace
+    return " ".join(token.translate(_TOKEN_TABLE).split()).lower()
 
 def extract_simple_services(lines: List[str]) -> List[Dict[str, Any]]:
     """Parse the "headers first, cells below" table layout that the
@@ -141,18 +283,6 @@ def extract_simple_services(lines: List[str]) -> List[Dict[str, Any]]:
     Returns a list of dictionaries, each representing one medical service.
     """
 
-    # ---------- Helpers ----------
-    def clean_token(token: str) -> str:
-        """Normalise a raw markdown line for easier matching."""
-        token = token.strip()
-        # Remove leading/trailing square brackets and any surrounding quotes
-        token = token.lstrip("[").rstrip("]")
-        token = re.sub(r"^[\[{](.*)[\]}]$", r"\1", token)  # remove any leftover braces
-        token = re.sub(r"['\"]", "", token)  # drop quotes
-        token = re.sub(r",", " ", token)      # commas → spaces
-        token = re.sub(r"\s+", " ", token)    # collapse whitespace
-        return token.lower().strip()
-
     # Map various OCR header spellings to canonical field names
     header_aliases = {
         "(code) service": "codeService",
@@ -179,12 +309,14 @@ def extract_simple_services(lines: List[str]) -> List[Dict[str, Any]]:
         "note": "note",
     }
 
+    # Each line is normalised once and reused by both passes below
+    cleaned_lines = [clean_token(raw_line) for raw_line in lines]
+
     # ---------- 1) Identify header block ----------
     headers: List[str] = []
     header_end_idx: Optional[int] = None
 
-    for idx, raw_line in enumerate(lines):
-        cleaned = clean_token(raw_line)
+    for idx, cleaned in enumerate(cleaned_lines):
         if not cleaned:
             continue
 
@@ -215,31 +347,37 @@ def extract_simple_services(lines: List[str]) -> List[Dict[str, Any]]:
         header_end_idx = len(lines)
 
     # ---------- 2) Gather cell values ----------
-    cells: List[str] = []
-    for raw_line in lines[header_end_idx:]:
-        cleaned = clean_token(raw_line)
-        if cleaned:
-            cells.append(cleaned)
+    cells: List[str] = [cleaned for cleaned in cleaned_lines[header_end_idx:] if cleaned]
 
     if not cells:
         return []
 
     # ---------- 3) Chunk into rows ----------
     row_size = len(headers)
-    services: List[Dict[str, Any]] = []
-
-    for start in range(0, len(cells), row_size):
-        chunk = cells[start:start + row_size]
-        if len(chunk) < row_size:
-            break  # ignore incomplete final row
+    row_count = len(cells) // row_size  # ignore incomplete final row
+    if not row_count:
+        return []
+    table = np.array(cells[:row_count * row_size], dtype=object).reshape(row_count, row_size)
+
+    # Convert numeric columns in one go; a column with any unparsable cell
+    # falls back to per-cell conversion with None for the bad cells
+    numeric_columns: Dict[int, List[Optional[float]]] = {}
+    for col, field_name in enumerate(headers):
+        if field_name in _NUMERIC_FIELDS:
+            try:
+                numeric_columns[col] = table[:, col].astype(np.float64).tolist()
+            except ValueError:
+                numeric_columns[col] = [_parse_float(value) for value in table[:, col]]
 
+    services: List[Dict[str, Any]] = []
+    for row_idx, chunk in enumerate(table.tolist()):
         row: Dict[str, Any] = {}
-        for header_field, cell_value in zip(headers, chunk):
+        for col, (header_field, cell_value) in enumerate(zip(headers, chunk)):
             field_name = header_field  # already canonical
 
             if field_name == 'codeService':
                 # Expected pattern: (CODE) Description of service
-                m = re.match(r"\(([^)]+)\)\s*(.*)", cell_value, flags=re.IGNORECASE)
+                m = _CODE_SERVICE_RE.match(cell_value)
                 if m:
                     row['code'] = m.group(1).strip()
                     desc = m.group(2).strip()
@@ -250,14 +388,8 @@ def extract_simple_services(lines: List[str]) -> List[Dict[str, Any]]:
                 continue
 
             # Convert numbers where sensible
-            if field_name in {
-                'reqQty', 'reqCost', 'grossAmount',
-                'appQty', 'appCost', 'appGross'
-            }:
-                try:
-                    row[field_name] = float(cell_value)
-                except ValueError:
-                    row[field_name] = None
+            if col in numeric_columns:
+                row[field_name] = numeric_columns[col][row_idx]
             else:
                 row[field_name] = cell_value
 
@@ -265,25 +397,26 @@ def extract_simple_services(lines: List[str]) -> List[Dict[str, Any]]:
 
     return services
 
-def find_payer_info(lines: List[str]) -> str:
-    """Extract payer information from the form."""
+def find_payer_info(lines: List[str], lower_lines: Optional[List[str]] = None) -> str:
+    """Extract payer information from the form.
+
+    *lower_lines* may carry the already lowercased *lines* so callers that
+    scan the same document several times only lowercase it once.
+    """
+    if lower_lines is None:
+        lower_lines = [line.lower() for line in lines]
     payer_info = []
     
     # Look for payer information patterns
-    for line in lines:
-        line_lower = line.lower()
-        
+    for line, line_lower in zip(lines, lower_lines):
         # Explicit payer marker
         if "payer:" in line_lower:
-            parts = re.split(r'payer\s*:', line, flags=re.IGNORECASE)
+            parts = _PAYER_SPLIT_RE.split(line)
             if len(parts) > 1:
                 payer_info.append(parts[1].strip())
         
         # Common payer message patterns
-        elif any(pattern in line_lower for pattern in [
-            "please note", "amount of", "requested services", "do not require", 
-            "prior approval", "policy's terms", "kindly provide", "necessary medical services"
-        ]):
+        elif _PAYER_MESSAGE_RE.search(line_lower):
             payer_info.append(line)
     
     if payer_info:
@@ -291,19 +424,21 @@ def find_payer_info(lines: List[str]) -> str:
     
     return ""
 
-def find_service_table_section(lines: List[str]) -> List[str]:
+def find_service_table_section(lines: List[str], lower_lines: Optional[List[str]] = None) -> List[str]:
     """Locate and return the slice of *lines* that corresponds to the service table.
     The form uses only **one** layout (formerly called *format1*), so we simply
     search for the first occurrence of an indicative header such as
     "(code) service", then gather a reasonable window of lines afterward.
+    *lower_lines* is the optional lowercased copy of *lines*, as in
+    :func:`find_payer_info`.
     """
+    if lower_lines is None:
+        lower_lines = [line.lower() for line in lines]
 
     start_idx: Optional[int] = None
     end_idx: Optional[int] = None
 
-    for i, line in enumerate(lines):
-        line_lower = line.lower()
-
+    for i, line_lower in enumerate(lower_lines):
         # The service table starts around the header "(code) service" or any
         # line that contains a parenthesised code pattern.
         if '(code)' in line_lower and 'service' in line_lower:
@@ -311,7 +446,7 @@ def find_service_table_section(lines: List[str]) -> List[str]:
             break
 
         # Fallback: detect the first line with the code pattern (90911-00-00)
-        if start_idx is None and re.search(r'\(\d+[^)]*-\d+[^)]*\)', line_lower):
+        if start_idx is None and _PRIMARY_CODE_RE.search(line_lower):
             start_idx = i - 1 if i > 0 else 0  # include possible header line just before
             break
 
@@ -323,14 +458,7 @@ def find_service_table_section(lines: List[str]) -> List[str]:
     # Heuristic: table rarely exceeds 30 lines; stop earlier when we hit
     # obvious unrelated sections.
     for j in range(start_idx, len(lines)):
-        line_lower = lines[j].lower()
-        if any(marker in line_lower for marker in [
-            'no data to be shown',
-            'in case management',
-            'i hereby',
-            'medication',
-            'completed/coded',
-            'providers approval']):
+        if _TABLE_END_RE.search(lower_lines[j]):
             end_idx = j
             break
 
@@ -357,7 +485,7 @@ def extract_service_format(table_lines: List[str]) -> List[Dict[str, Any]]:
     
     for i, line in enumerate(all_lines):
         # Check if line contains a primary service code
-        if re.search(r'\((\d+[^)]*-\d+[^)]*)\)', line):
+        if _PRIMARY_CODE_RE.search(line):
             # If we already have a section, save it
             if current_section:
                 service_sections.append(current_section)
@@ -378,40 +506,46 @@ def extract_service_format(table_lines: List[str]) -> List[Dict[str, Any]]:
         # Initialize service data
         service = {}
         
-        # Extract primary code
-        for line in section:
-            primary_match = re.search(r'\((\d+[^)]*-\d+[^)]*)\)', line)
-            if primary_match:
-                service['code'] = primary_match.group(1)
-                
-                # Extract description after code
-                desc_part = line[primary_match.end():].strip()
-                if desc_part:
-                    service['description'] = desc_part
-                break
-        
-        # If no primary code found, skip this section
-        if 'code' not in service:
-            continue
-        
-        # Extract additional codes
+        # Walk the section once: the primary code comes first, any later
+        # line may carry additional codes
         additional_codes = []
+        # Running description; the membership test below scans it directly
+        # instead of re-joining the parts for every candidate fragment
+        desc_text = ""
         for line in section:
+            if 'code' not in service:
+                primary_match = next(
+                    (m for m in _CODE_ANY_RE.finditer(line) if '-' in m.group(1)), None)
+                if primary_match:
+                    service['code'] = primary_match.group(1)
+                    
+                    # Extract description after code
+                    desc_part = line[primary_match.end():].strip()
+                    if desc_part:
+                        desc_text = desc_part
+                continue
+            
             # Look for additional codes but not the primary code
-            if 'code' in service and service['code'] not in line:
-                add_match = re.search(r'\((\d+)\)', line)
+            if service['code'] not in line:
+                add_match = _CODE_ANY_RE.search(line)
                 if add_match:
                     additional_codes.append(add_match.group(1))
                     
                     # If the additional code is in a line with text, add to description
-                    if 'description' not in service:
-                        text_without_code = re.sub(r'\(\d+\)', '', line).strip()
-                        if text_without_code:
-                            service['description'] = text_without_code
-                    else:
-                        text_without_code = re.sub(r'\(\d+\)', '', line).strip()
-                        if text_without_code and text_without_code not in service['description']:
-                            service['description'] += " " + text_without_code
+                    text_without_code = (
+                        line[:add_match.start()] + _CODE_ANY_RE.sub('', line[add_match.end():])
+                    ).strip()
+                    # Skip text already present anywhere in the description,
+                    # including across part boundaries
+                    if text_without_code and text_without_code not in desc_text:
+                        desc_text = f"{desc_text} {text_without_code}" if desc_text else text_without_code
+        
+        # If no primary code found, skip this section
+        if 'code' not in service:
+            continue
+        
+        if desc_text:
+            service['description'] = desc_text
         
         if additional_codes:
             service['additionalCodes'] = additional_codes
@@ -425,7 +559,7 @@ def extract_service_format(table_lines: List[str]) -> List[Dict[str, Any]]:
         # Look for numeric values
         numeric_values = []
         for line in section:
-            if re.match(r'^\d+\.?\d*$', line):
+            if _NUMBER_RE.match(line):
                 numeric_values.append(float(line))
         
         # Assign numeric values to fields
@@ -452,38 +586,73 @@ def extract_service_format(table_lines: List[str]) -> List[Dict[str, Any]]:
 
 def clean_service_description(raw_description: str) -> str:
     """Clean up service description by removing unwanted parts."""
-    # Unwanted parts that might appear in descriptions
-    unwanted_sections = [
-        # Service Provider & Staff sections
-        "services Providers", "Providers Approval", "Approval/Coding", "Staff must", "review/code", 
-        "completethe following", "Completed/Coded", "Signature", "Date", "Medication",
-        # Form elements that aren't part of description
-        "Type Req", "Req. Qty", "Req. Cost", "Gross amount", "App. Qty", "App. Cost", "App. Gross", "Note",
-        # Additional unwanted parts that might be present
-        "Providers", "Staff", "Generic", "Signature", "Coded By"
-    ]
-    
     # Find the earliest cutoff point
-    earliest_cutoff = len(raw_description)
-    for section in unwanted_sections:
-        pos = raw_description.find(section)
-        if pos != -1 and pos < earliest_cutoff:
-            earliest_cutoff = pos
+    cutoff_match = _CUTOFF_RE.search(raw_description)
+    earliest_cutoff = cutoff_match.start() if cutoff_match else len(raw_description)
     
     # Cut off at the earliest unwanted section
     clean_description = raw_description[:earliest_cutoff].strip()
     
     # Clean up extra spaces
-    clean_description = re.sub(r'\s+', ' ', clean_description).strip()
+    clean_description = _WS_RE.sub(' ', clean_description).strip()
     return clean_description
 
-def convert_to_json(ocr_text: str, file_name: str) -> Dict[str, Any]:
-    """Convert OCR text to JSON using GPT-4 and validate with Pydantic models."""
-    # Preprocess the OCR text
-    processed_text = preprocess_ocr_text(ocr_text)
+# Parser field -> suggestedServices field, in output order
+_SERVICE_FIELD_MAP = (
+    ("reqQty", "requestedQuantity"),
+    ("reqCost", "requestedCost"),
+    ("grossAmount", "grossAmount"),
+    ("appQty", "approvedQuantity"),
+    ("appCost", "approvedCost"),
+    ("appGross", "approvedGross"),
+    ("type", "serviceType"),
+    ("status", "status"),
+    ("note", "note"),
+)
+
+def clean_formatted_description(desc: Any) -> str:
+    """Turn a parsed service description into plain text."""
+    # Make sure it's a string
+    if not isinstance(desc, str):
+        desc = str(desc)
+    
+    # Replace complex array notation with simple text
+    if '[' in desc and ']' in desc:
+        # Extract all words from inside quotes within list/array notations
+        extracted_content = [
+            word
+            for match in _BRACKET_CONTENT_RE.findall(desc)
+            for word in _QUOTED_WORD_RE.findall(match)
+        ]
+        
+        # Join all extracted words and replace original description
+        if extracted_content:
+            desc = ' '.join(extracted_content)
+    
+    # Apply general pattern matching
+    desc = _SUFFIX_RE.sub(r'\1\2', desc)
     
-    # Construct the prompt with additional instructions
-    additional_instructions = """
+    # Remove any remaining brackets, quotes, commas
+    desc = _DESC_PUNCT_RE.sub('', desc)
+    desc = _WS_RE.sub(' ', desc)  # Normalize whitespace
+    desc = _DESC_TAIL_RE.sub('', desc) # Remove markdown, dates and rules
+    return desc.strip()
+
+def format_service(service: Dict[str, Any]) -> Dict[str, Any]:
+    """Map one parsed service onto the suggestedServices shape."""
+    formatted_service = {
+        "code": service.get("code", ""),
+        "description": clean_formatted_description(service.get("description", "")),
+        "additionalCodes": service.get("additionalCodes", []),
+    }
+    formatted_service.update(
+        (dest_key, service[src_key]) for src_key, dest_key in _SERVICE_FIELD_MAP if src_key in service
+    )
+    logger.debug("Formatted service %s as %s", service, formatted_service)
+    return formatted_service
+
+# Static prompt parts, built once; only the OCR text changes per request
+ADDITIONAL_INSTRUCTIONS = """
 IMPORTANT INSTRUCTIONS:
 1. Only convert parentheses to true/false for checkbox fields (single, married, newVisit, etc.). For other fields like signature, keep the original text.
 2. PRESERVE ALL ARABIC TEXT EXACTLY AS IT APPEARS - DO NOT TRANSLATE:
@@ -520,15 +689,10 @@ IMPORTANT INSTRUCTIONS:
   "patientSignatureDate": "2024-01-01"
 }
 """
-    full_prompt = MAIN_PROMPT + additional_instructions + "\n\nHere's the OCR text:\n\n" + processed_text
-    
-    # Make the API call
-    response = client.chat.completions.create(
-        model="gpt-4o-2024-11-20",
-        messages=[
-            {
-                "role": "system", 
-                "content": """You are a helpful assistant that converts OCR text to structured JSON. 
+_PROMPT_PREFIX = MAIN_PROMPT + ADDITIONAL_INSTRUCTIONS + "\n\nHere's the OCR text:\n\n"
+_SYSTEM_MESSAGE = {
+    "role": "system", 
+    "content": """You are a helpful assistant that converts OCR text to structured JSON. 
 Important guidelines:
 - Pay special attention to field types - only use boolean true/false for checkbox fields
 - Use strings for text fields like signatures and names
@@ -537,41 +701,56 @@ Important guidelines:
 - Do not transliterate or modify any Arabic text
 - For mixed Arabic/English text, preserve both languages exactly as they appear
 """
-            },
-            {"role": "user", "content": full_prompt}
+}
+
+def _completion_request(processed_text: str) -> Dict[str, Any]:
+    """Build the chat completion arguments for the preprocessed OCR text."""
+    return dict(
+        model="gpt-4o-2024-11-20",
+        messages=[
+            _SYSTEM_MESSAGE,
+            {"role": "user", "content": _PROMPT_PREFIX + processed_text}
         ],
+        response_format={"type": "json_object"},
         temperature=0,
         max_tokens=4000
     )
-    
-    # Extract and parse the JSON response
-    json_str = response.choices[0].message.content
-    # Find the JSON part (between first { and last })
-    start = json_str.find('{')
-    end = json_str.rfind('}') + 1
-    if start >= 0 and end > 0:
-        json_str = json_str[start:end]
-    
+
+# Serializer for the validated form content, resolved once at import
+_FORM_CONTENT_ADAPTER = TypeAdapter(MedicalFormContent)
+
+def _structured_ocr_dump(file_name: str, content: MedicalFormContent) -> Dict[str, Any]:
+    """Wrap form content in the StructuredOCR envelope and dump it.
+
+    The envelope fields are constants, so the dict is built directly in
+    StructuredOCR's field order (the unset optional fields are dropped by
+    exclude_none anyway); only the content tree goes through pydantic.
+    """
+    return {
+        "file_name": file_name,
+        "topics": ["medical_form"],
+        "languages": [Language.ENGLISH, Language.ARABIC],
+        "ocr_contents": _FORM_CONTENT_ADAPTER.dump_python(content, exclude_none=True),
+        "document_type": "UCAF Medical Form",
+        "confidence_score": 0.95,  # Example score
+    }
+
+def _structure_response(json_str: str, lines: List[str], file_name: str) -> Optional[Dict[str, Any]]:
+    """Validate the model's JSON reply and merge in the locally parsed payer
+    info and services. Returns None if the reply cannot be used."""
     try:
-        # Parse the raw JSON first
-        raw_json = json.loads(json_str)
+        # JSON mode guarantees the whole reply is a single JSON object, so
+        # pydantic-core validates it straight from the JSON text
+        content = MedicalFormContent.model_validate_json(json_str)
         
-        # Create a StructuredOCR object with the parsed data
-        structured_data = StructuredOCR(
-            file_name=file_name,
-            topics=["medical_form"],
-            languages=[Language.ENGLISH, Language.ARABIC],
-            ocr_contents=MedicalFormContent(**raw_json),
-            document_type="UCAF Medical Form",
-            confidence_score=0.95  # Example score
-        )
+        # Wrap the parsed data in the StructuredOCR envelope and dump it
+        # once; the steps below update this dict in place
+        json_data = _structured_ocr_dump(file_name, content)
         
         # Extract payer information using specialized function
-        lines = ocr_text.split('\n')
-        payer_info = find_payer_info(lines)
-        if payer_info and "ocr_contents" in structured_data.model_dump(exclude_none=True):
-            # Update the payer information in the structured data
-            json_data = structured_data.model_dump(exclude_none=True)
+        lower_lines = [line.lower() for line in lines]
+        payer_info = find_payer_info(lines, lower_lines)
+        if payer_info:
             # Check if payerInfo exists in the JSON, if not create it
             if "payerInfo" not in json_data["ocr_contents"] or not json_data["ocr_contents"]["payerInfo"]:
                 json_data["ocr_contents"]["payerInfo"] = {"comments": payer_info}
@@ -582,16 +761,13 @@ Important guidelines:
                     json_data["ocr_contents"]["payerInfo"]["comments"] = f"{existing_comments} {payer_info}"
                 else:
                     json_data["ocr_contents"]["payerInfo"]["comments"] = payer_info
-            
-            # Update the structured data with the enhanced payer info
-            structured_data = StructuredOCR(**json_data)
         
         # ---------- Service extraction ----------
         services = None
         extraction_method = "none"
 
         # 1) Try the vertical-table parser first (matches actual form layout)
-        table_lines = find_service_table_section(lines)
+        table_lines = find_service_table_section(lines, lower_lines)
         if table_lines:
             services = extract_simple_services(table_lines)
             if services:
@@ -603,135 +779,162 @@ Important guidelines:
             if services:
                 extraction_method = "format1"
         
-        print(f"DEBUG: Using extraction method: {extraction_method}")
-        print(f"DEBUG: Final extracted services: {services}")
+        logger.debug("Using extraction method: %s", extraction_method)
+        logger.debug("Final extracted services: %s", services)
         
-        if services and "ocr_contents" in structured_data.model_dump(exclude_none=True):
-            # Replace in the structured data
-            json_data = structured_data.model_dump(exclude_none=True)
-            
-            # Properly format the services with all fields
-            formatted_services = []
-            for service in services:
-                print(f"DEBUG: Processing service: {service}")
-                
-                formatted_service = {
-                    "code": service.get("code", ""),
-                    "description": service.get("description", ""),
-                    "additionalCodes": service.get("additionalCodes", [])
-                }
-                
-                # Clean up description with general pattern matching if needed
-                if "description" in formatted_service:
-                    desc = formatted_service["description"]
-                    # Make sure it's a string
-                    if not isinstance(desc, str):
-                        desc = str(desc)
-                    
-                    # Replace complex array notation with simple text
-                    if '[' in desc and ']' in desc:
-                        # Extract all content from inside list/array notations
-                        content_matches = re.findall(r'\[(.*?)\]', desc)
-                        extracted_content = []
-                        for match in content_matches:
-                            # Extract words from inside quotes
-                            words = re.findall(r'\'([^\']+)\'', match)
-                            if words:
-                                extracted_content.extend(words)
-                        
-                        # Join all extracted words and replace original description
-                        if extracted_content:
-                            desc = ' '.join(extracted_content)
-                    
-                    # Apply general pattern matching
-                    desc = re.sub(r'(\w+)\s+um\b', r'\1um', desc)
-                    desc = re.sub(r'(\w+)\s+er\b', r'\1er', desc)
-                    desc = re.sub(r'(\w+)\s+ing\b', r'\1ing', desc)
-                    desc = re.sub(r'(\w+)\s+ed\b', r'\1ed', desc)
-                    desc = re.sub(r'(\w+)\s+al\b', r'\1al', desc)
-                    desc = re.sub(r'(\w+)\s+sis\b', r'\1sis', desc)
-                    desc = re.sub(r'(\w+)\s+tion\b', r'\1tion', desc)
-                    desc = re.sub(r'(\w+)\s+phy\b', r'\1phy', desc)
-                    desc = re.sub(r'(\w+)\s+gram\b', r'\1gram', desc)
-                    
-                    # Remove any remaining brackets, quotes, commas
-                    desc = re.sub(r'[\[\]\'\",]', '', desc)
-                    desc = re.sub(r'\s+', ' ', desc)  # Normalize whitespace
-                    desc = re.sub(r'```.*$', '', desc) # Remove markdown
-                    desc = re.sub(r'\s+Date.*$', '', desc)
-                    desc = re.sub(r'\s+---.*$', '', desc)
-                    
-                    formatted_service["description"] = desc.strip()
-                
-                # Map numeric fields
-                if "reqQty" in service:
-                    formatted_service["requestedQuantity"] = service["reqQty"]
-                    print(f"DEBUG: Adding requestedQuantity: {service['reqQty']}")
-                if "reqCost" in service:
-                    formatted_service["requestedCost"] = service["reqCost"]
-                    print(f"DEBUG: Adding requestedCost: {service['reqCost']}")
-                if "grossAmount" in service:
-                    formatted_service["grossAmount"] = service["grossAmount"]
-                    print(f"DEBUG: Adding grossAmount: {service['grossAmount']}")
-                if "appQty" in service:
-                    formatted_service["approvedQuantity"] = service["appQty"]
-                    print(f"DEBUG: Adding approvedQuantity: {service['appQty']}")
-                if "appCost" in service:
-                    formatted_service["approvedCost"] = service["appCost"]
-                    print(f"DEBUG: Adding approvedCost: {service['appCost']}")
-                if "appGross" in service:
-                    formatted_service["approvedGross"] = service["appGross"]
-                    print(f"DEBUG: Adding approvedGross: {service['appGross']}")
-                
-                # Add type if available
-                if "type" in service:
-                    formatted_service["serviceType"] = service["type"]
-                    print(f"DEBUG: Adding serviceType: {service['type']}")
-                
-                # Add status if available
-                if "status" in service:
-                    formatted_service["status"] = service["status"]
-                    print(f"DEBUG: Adding status: {service['status']}")
-                
-                # Add note if available
-                if "note" in service:
-                    formatted_service["note"] = service["note"]
-                    print(f"DEBUG: Adding note: {service['note']}")
-                
-                formatted_services.append(formatted_service)
-                print(f"DEBUG: Final formatted service: {formatted_service}")
-            
+        if services:
+            formatted_services = [format_service(service) for service in services]
             json_data["ocr_contents"]["suggestedServices"] = formatted_services
-            print(f"DEBUG: Final suggestedServices: {json_data['ocr_contents']['suggestedServices']}")
-            return json_data
+            logger.debug("Final suggestedServices: %s", formatted_services)
         
-        # Convert to dict for JSON serialization if no service extraction was done
-        return structured_data.model_dump(exclude_none=True)
-    except Exception as e:
-        print(f"Error processing JSON: {e}")
+        return json_data
+    except Exception:
+        logger.exception("Error processing JSON")
         return None
 
-def main():
-    # Input and output paths
-    input_md = "outputs/az_results_1.md"
-    output_json = "outputs/az_results_1.json"
+# Results of recent conversions, keyed by a digest of the OCR text alone (API
+# callers pass a fresh temp file name per request), so re-runs on identical
+# text skip the API call. Only successful results are kept and callers always
+# get their own copy, stamped with their own file name.
+_CONVERT_CACHE_SIZE = 128
+_convert_cache: "OrderedDict[bytes, Dict[str, Any]]" = OrderedDict()
+_convert_cache_lock = threading.Lock()
+
+def _cache_key(ocr_text: str) -> bytes:
+    return hashlib.sha256(ocr_text.encode("utf-8")).digest()
+
+def _cache_get(key: bytes, file_name: str) -> Optional[Dict[str, Any]]:
+    with _convert_cache_lock:
+        result = _convert_cache.get(key)
+        if result is None:
+            return None
+        _convert_cache.move_to_end(key)
+    result = copy.deepcopy(result)
+    result["file_name"] = file_name
+    return result
+
+def _cache_put(key: bytes, result: Optional[Dict[str, Any]]) -> None:
+    if result is None:
+        return
+    result = copy.deepcopy(result)
+    with _convert_cache_lock:
+        _convert_cache[key] = result
+        _convert_cache.move_to_end(key)
+        if len(_convert_cache) > _CONVERT_CACHE_SIZE:
+            _convert_cache.popitem(last=False)
+
+def convert_to_json(ocr_text: str, file_name: str) -> Dict[str, Any]:
+    """Convert OCR text to JSON using GPT-4 and validate with Pydantic models."""
+    # Nothing to extract: skip the API round trip
+    if not ocr_text.strip():
+        return _structured_ocr_dump(file_name, MedicalFormContent())
     
-    # Read the markdown file
-    markdown_content = read_markdown_file(input_md)
+    key = _cache_key(ocr_text)
+    cached = _cache_get(key, file_name)
+    if cached is not None:
+        return cached
     
-    # Extract OCR text
-    ocr_text = extract_ocr_text(markdown_content)
+    # Split once; the raw lines feed the local parsers, the preprocessed
+    # ones the prompt
+    lines = ocr_text.split('\n')
+    processed_text = '\n'.join(preprocess_ocr_lines(lines))
+    
+    # Make the API call
+    response = client.chat.completions.create(**_completion_request(processed_text))
+    
+    # Extract and parse the JSON response
+    result = _structure_response(response.choices[0].message.content, lines, file_name)
+    _cache_put(key, result)
+    return result
+
+async def convert_to_json_async(ocr_text: str, file_name: str) -> Dict[str, Any]:
+    """Async variant of :func:`convert_to_json` using the shared async client."""
+    if not ocr_text.strip():
+        return _structured_ocr_dump(file_name, MedicalFormContent())
+    key = _cache_key(ocr_text)
+    cached = _cache_get(key, file_name)
+    if cached is not None:
+        return cached
+    lines = ocr_text.split('\n')
+    processed_text = '\n'.join(preprocess_ocr_lines(lines))
+    response = await aclient.chat.completions.create(**_completion_request(processed_text))
+    result = _structure_response(response.choices[0].message.content, lines, file_name)
+    _cache_put(key, result)
+    return result
+
+async def convert_to_json_batch(
+    items: Iterable[Tuple[str, str]], concurrency: int = 8
+) -> List[Optional[Dict[str, Any]]]:
+    """Convert many ``(ocr_text, file_name)`` pairs, keeping up to
+    *concurrency* API requests in flight. Results keep the input order."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def convert_one(ocr_text: str, file_name: str) -> Optional[Dict[str, Any]]:
+        async with semaphore:
+            return await convert_to_json_async(ocr_text, file_name)
+
+    return await asyncio.gather(*(convert_one(text, name) for text, name in items))
+
+def write_bytes_atomic(path: Path, data: bytes) -> None:
+    """Write *data* to *path* through a temp file and an atomic rename."""
+    # Raw fd writes skip the buffered file object; the payload is already bytes
+    tmp_path = path.with_name(path.name + ".tmp")
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(fd, view):]
+    finally:
+        os.close(fd)
+    os.replace(tmp_path, path)
+
+def convert_one(input_md: Path, output_json: Path, pretty: bool = False) -> bool:
+    """Convert one OCR markdown file and write its JSON next to it.
+
+    The JSON is compact unless *pretty* asks for 2-space indentation.
+    """
+    # Extract the OCR text straight from the markdown file
+    ocr_text = read_ocr_text(input_md)
     
     # Convert to JSON using the file name as reference
-    json_data = convert_to_json(ocr_text, os.path.basename(input_md))
+    json_data = convert_to_json(ocr_text, input_md.name)
+    
+    if not json_data:
+        return False
+    
+    # Write the JSON output
+    option = orjson.OPT_NON_STR_KEYS
+    if pretty:
+        option |= orjson.OPT_INDENT_2
+    write_bytes_atomic(output_json, orjson.dumps(json_data, option=option))
+    return True
+
+def main(pretty: bool = False):
+    # Input and output paths
+    input_mds = sorted(Path("outputs").glob("az_results_*.md"))
+    if not input_mds:
+        print("No OCR markdown files found in outputs/")
+        return
     
-    if json_data:
-        # Write the JSON output
-        with open(output_json, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, indent=2, ensure_ascii=False)
-        print(f"Successfully converted {input_md} to {output_json}")
-    else:
-        print("Failed to convert OCR text to JSON")
+    # Each conversion mostly waits on the OpenAI API, so a thread pool
+    # overlaps them
+    max_workers = min(32, (os.cpu_count() or 1) * 4, len(input_mds))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(convert_one, input_md, input_md.with_suffix(".json"), pretty): input_md
+            for input_md in input_mds
+        }
+        for future in as_completed(futures):
+            input_md = futures[future]
+            try:
+                converted = future.result()
+            except Exception as e:
+                print(f"Failed to convert {input_md}: {e}")
+                continue
+            if converted:
+                print(f"Successfully converted {input_md}")
+            else:
+                print(f"Failed to convert OCR text to JSON for {input_md}")
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main(pretty="--pretty" in sys.argv[1:]) 
\ No newline at end of file
@@ -16,13 +16,17 @@ import sys
 import json
 import logging
 import requests
+from requests.adapters import HTTPAdapter
 import os
 import re
+import shutil
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeoutError
 from tenacity import retry, stop_after_attempt, wait_exponential, retry_if_exception_type
-from fuzzywuzzy import fuzz, process
+from rapidfuzz import fuzz, process
+from rapidfuzz.utils import default_process
 from mimetypes import guess_extension
 from dotenv import load_dotenv
 import asyncio
@@ -57,13 +61,27 @@ sensitive_data = {
     "password": PASSWORD
 }
 
+# Text inside parentheses, e.g. the short name in "Bupa Arabia (BUPA)"
+_PAREN_RE = re.compile(r'\((.*?)\)')
+# A "(code) description" tail of a service description
+_PAREN_SUFFIX_RE = re.compile(r'\((.*?)\)\s*(.*)')
+# Phrases that only add noise to service descriptions, removed in this order
+_NOISE_PATTERNS = [re.compile(rf'\b{phrase}\b', re.IGNORECASE) for phrase in ('refer to other hospital', 'for', 'with', 'and')]
+# Single-pass character replacements used when cleaning names and options
+_PAREN_TABLE = str.maketrans("()", "  ")
+_PUNCT_TRANSLATE = str.maketrans("().,", "    ")
+_DASH_PUNCT_TRANSLATE = str.maketrans("-().,", "     ")
+_OPTION_CLEAN_TABLE = str.maketrans("-,()", "    ")
+# Attachment filename in a Content-Disposition header
+_FILENAME_RE = re.compile(r'filename="([^"]+)"')
+
 def extract_key_words(value: str) -> str:
     """Extracts key words from insurance names, handling parentheses, camelCase, and 'Al' prefixes."""
     if not value:
         return ""
     
     generic_terms = {"the", "and", "company", "reinsurance", "cooperative", "complex", "insurance"}
-    value = value.replace("(", " ").replace(")", " ").strip()
+    value = value.translate(_PAREN_TABLE).strip()
     
     result = ""
     if value.lower().startswith("al") and len(value) > 2:
@@ -84,6 +102,22 @@ def extract_key_words(value: str) -> str:
     key_words = [word for word in words if word.lower() not in generic_terms]
     return " ".join(key_words)
 
+def sorted_tokens(text: str) -> str:
+    """Return *text* the way token_sort_ratio compares it: processed, words sorted."""
+    return " ".join(sorted(default_process(text).split()))
+
+def direct_match_index(value: str, options: list) -> int | None:
+    """Index of the option equal to *value*, else of the closest-length option containing it or contained in it (whole words, case-insensitive)."""
+    if not value.strip():
+        return None
+    needle = f" {value.lower()} "
+    padded = [f" {option.lower()} " for option in options]
+    exact = next((i for i, option in enumerate(padded) if option == needle), None)
+    if exact is not None:
+        return exact
+    hits = [i for i, option in enumerate(padded) if option.strip() and (needle in option or option in needle)]
+    return min(hits, key=lambda i: abs(len(padded[i]) - len(needle)), default=None)
+
 def select_or_type_dropdown(page, dropdown_type: str, dropdown_input_xpath: str, list_id: str, value: str, dropdown_arrow_xpath: str = None, timeout: int = 20000) -> str:
     try:
         if not value:
@@ -123,7 +157,7 @@ def select_or_type_dropdown(page, dropdown_type: str, dropdown_input_xpath: str,
 
         paren_chunks = []
         paren_words = set()
-        paren_matches = re.findall(r'\((.*?)\)', value)
+        paren_matches = _PAREN_RE.findall(value)
         for match in paren_matches:
             match_words = extract_key_words(match).split()
             for size in range(1, len(match_words) + 1):
@@ -205,33 +239,34 @@ def select_or_type_dropdown(page, dropdown_type: str, dropdown_input_xpath: str,
                     cleaned_option = option
                 cleaned_options.append(cleaned_option)
         else:
-            cleaned_options = [opt.replace("-", " ").replace(",", " ").replace("(", " ").replace(")", " ").strip() for opt in available_options]
+            cleaned_options = [opt.translate(_OPTION_CLEAN_TABLE).strip() for opt in available_options]
         logger.info(f"Cleaned options for fuzzy matching: {cleaned_options}")
 
+        # default_process keeps fuzzywuzzy's lowercase/strip-punctuation
+        # preprocessing; extractOne also hands back the option's index
         best_match_cleaned = None
+        best_match_index = None
         best_score = 0
         best_chunk = None
         for chunk in chunks:
-            match, score = process.extractOne(chunk, cleaned_options, scorer=fuzz.token_sort_ratio)
+            match, score, index = process.extractOne(chunk, cleaned_options, scorer=fuzz.token_sort_ratio, processor=default_process)
             if score > best_score:
                 best_match_cleaned = match
+                best_match_index = index
                 best_score = score
                 best_chunk = chunk
         logger.info(f"Best fuzzy match for chunks '{chunks}': '{best_match_cleaned}' with score {best_score} (from chunk '{best_chunk}')")
 
         if best_score >= 60:
-            original_match, original_score = process.extractOne(key_input, cleaned_options, scorer=fuzz.token_sort_ratio)
+            original_match, original_score, original_index = process.extractOne(key_input, cleaned_options, scorer=fuzz.token_sort_ratio, processor=default_process)
             logger.info(f"Double-check with original '{key_input}': '{original_match}' with score {original_score}")
 
             if original_score >= 50:
-                best_match_index = cleaned_options.index(best_match_cleaned)
                 best_match = available_options[best_match_index]
             elif original_score > best_score:
-                best_match_index = cleaned_options.index(original_match)
-                best_match = available_options[best_match_index]
+                best_match = available_options[original_index]
                 logger.info(f"Overriding chunk match with original match '{original_match}' (score {original_score} > {best_score})")
             else:
-                best_match_index = cleaned_options.index(best_match_cleaned)
                 best_match = available_options[best_match_index]
 
             if dropdown_type in ["carrier_type", "carrier"]:
@@ -254,7 +289,12 @@ def select_or_type_dropdown(page, dropdown_type: str, dropdown_input_xpath: str,
                 if best_match in available_options:
                     target_index = available_options.index(best_match)
                     logger.info(f"Target option '{best_match}' found at index {target_index}")
-                    
+
+                    if click_option_by_text(page, list_id, best_match):
+                        wait_for_ajax_idle(page)
+                        logger.info(f"Selected {dropdown_type}: '{best_match}' by clicking the list item")
+                        return best_match
+
                     page.click(f'xpath={dropdown_input_xpath}')
                     page.wait_for_timeout(500)
 
@@ -297,7 +337,40 @@ def select_or_type_dropdown(page, dropdown_type: str, dropdown_input_xpath: str,
             return ""
         return type_and_enter_kendo_dropdown(page, dropdown_input_xpath, extract_key_words(value))
 
+# XPaths found visible by the last probe_field_xpaths() call; the first
+# lookup of each lets find_element_with_fallback() skip its round trip.
+_visible_xpaths: set[str] = set()
+
+def probe_field_xpaths(page) -> None:
+    """Check every FIELD_MAPPING xpath for a visible element in a single page.evaluate call."""
+    xpaths = sorted({
+        xpath
+        for mapping in FIELD_MAPPING.values()
+        for key, xpath in mapping.items()
+        if key.endswith("xpath") and isinstance(xpath, str)
+    })
+    try:
+        visible = page.evaluate("""(xpaths) => xpaths.map(x => {
+            try {
+                const n = document.evaluate(x, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+                return !!n && n.nodeType === 1 && n.getClientRects().length > 0 && getComputedStyle(n).visibility !== 'hidden';
+            } catch (e) {
+                return false;
+            }
+        })""", xpaths)
+    except Exception as e:
+        logger.warning(f"Failed to probe field xpaths: {str(e)}")
+        visible = []
+    _visible_xpaths.clear()
+    _visible_xpaths.update(xpath for xpath, is_visible in zip(xpaths, visible) if is_visible)
+    logger.info(f"{len(_visible_xpaths)}/{len(xpaths)} field xpaths visible")
+
 def find_element_with_fallback(page, primary_xpath: str, fallback_selector: str, label_text: str = None, timeout: int = 10000) -> bool:
+    # Each probe result is trusted once: later lookups of the same xpath
+    # (after dialogs, cascades or a save have re-rendered the form) wait again
+    if primary_xpath in _visible_xpaths:
+        _visible_xpaths.discard(primary_xpath)
+        return True
     try:
         page.wait_for_selector(f'xpath={primary_xpath}', state='visible', timeout=timeout)
         return True
@@ -314,6 +387,29 @@ def find_element_with_fallback(page, primary_xpath: str, fallback_selector: str,
             logger.error(f"Fallback selector {fallback_selector} also not found.")
             return False
 
+def click_option_by_text(page, list_id: str, text: str, timeout: int = 5000) -> bool:
+    """Click the Kendo list item labelled `text` directly instead of stepping to it with ArrowDown."""
+    locators = []
+    if '"' not in text:
+        locators.append(page.locator(f'xpath=//ul[@id="{list_id}"]/li[normalize-space()="{text}"]'))
+    locators.append(page.locator(f'ul#{list_id} li').get_by_text(text, exact=True))
+    for locator in locators:
+        try:
+            locator.first.click(timeout=timeout)
+            return True
+        except PlaywrightTimeoutError:
+            continue
+    return False
+
+def wait_for_ajax_idle(page, timeout: int = 10000) -> bool:
+    """Wait until jQuery (which the Kendo widgets use) has no AJAX requests in flight."""
+    try:
+        page.wait_for_function("() => !window.jQuery || window.jQuery.active === 0", timeout=timeout)
+        return True
+    except PlaywrightTimeoutError:
+        logger.warning(f"AJAX requests still pending after {timeout} ms")
+        return False
+
 def log_available_options(page, list_xpath: str, has_nested_span_p: bool = False, timeout: int = 10000) -> list:
     try:
         page.wait_for_selector(f'xpath={list_xpath}', state='visible', timeout=timeout)
@@ -329,6 +425,27 @@ def log_available_options(page, list_xpath: str, has_nested_span_p: bool = False
         logger.error(f"Failed to log available options at {list_xpath}: {str(e)}", exc_info=True)
         return []
 
+# The worker runs indefinitely, so scraped listbox contents are kept in memory
+# between patients.  Keys are the list xpath, optionally suffixed with
+# "|<typed text>" for server-filtered lists whose contents depend on the input.
+DROPDOWN_CACHE_TTL = 600  # seconds
+_dropdown_cache: dict[str, tuple[float, list[str]]] = {}
+
+def cached_options(page, list_xpath: str, has_nested_span_p: bool = False, key: str = None) -> list:
+    key = key or list_xpath
+    entry = _dropdown_cache.get(key)
+    if entry and time.monotonic() - entry[0] < DROPDOWN_CACHE_TTL:
+        logger.info(f"Using cached options for {key}")
+        return entry[1]
+    available_options = log_available_options(page, list_xpath, has_nested_span_p)
+    if available_options:
+        _dropdown_cache[key] = (time.monotonic(), available_options)
+    return available_options
+
+def invalidate_dropdown_cache(list_xpath: str) -> None:
+    for key in [k for k in _dropdown_cache if k == list_xpath or k.startswith(f"{list_xpath}|")]:
+        del _dropdown_cache[key]
+
 def retry_operation(page, action, max_attempts, value, xpath, timeout=2000):
     for attempt in range(max_attempts):
         try:
@@ -354,15 +471,23 @@ def select_kendo_dropdown_by_arrow(page, dropdown_arrow_xpath: str, list_id: str
             return ""
         list_xpath = f"//ul[@id='{list_id}']"
         page.wait_for_selector(f'xpath={list_xpath}', state='visible', timeout=timeout)
-        available_options = log_available_options(page, list_xpath, has_nested_span_p)
+        available_options = cached_options(page, list_xpath, has_nested_span_p)
+        if value not in available_options:
+            # A stale cache entry must not hide a newly added option.
+            invalidate_dropdown_cache(list_xpath)
+            available_options = cached_options(page, list_xpath, has_nested_span_p)
         if value not in available_options:
             logger.warning(f"Value '{value}' not found in dropdown options: {available_options}")
             return ""
         option_xpath = f"{list_xpath}/li[span/p[text()='{value}']]" if has_nested_span_p else f"{list_xpath}/li[text()='{value}']"
-        option_element = page.wait_for_selector(f'xpath={option_xpath}', state='visible', timeout=timeout)
-        option_element.scroll_into_view_if_needed()
-        page.wait_for_timeout(1000)
-        page.click(f'xpath={option_xpath}')
+        try:
+            option_element = page.wait_for_selector(f'xpath={option_xpath}', state='visible', timeout=timeout)
+            option_element.scroll_into_view_if_needed()
+            page.wait_for_timeout(1000)
+            page.click(f'xpath={option_xpath}')
+        except Exception:
+            invalidate_dropdown_cache(list_xpath)
+            raise
         page.wait_for_timeout(1000)
         page.wait_for_timeout(3000)
         logger.info(f"Selected {value} in Kendo dropdown at {dropdown_arrow_xpath}")
@@ -473,8 +598,7 @@ def select_or_type_modality(page, dropdown_arrow_xpath: str, dropdown_input_xpat
         cleaned_value = extract_key_words(value)
         logger.info(f"Extracted key words from '{value}': '{cleaned_value}'")
 
-        cleaned_value = cleaned_value.replace("-", " ").replace("(", " ").replace(")", " ").replace(".", " ").replace(",", " ").strip()
-        cleaned_value = " ".join(cleaned_value.split())
+        cleaned_value = " ".join(cleaned_value.translate(_DASH_PUNCT_TRANSLATE).split())
         logger.info(f"Cleaned value after removing special characters: '{cleaned_value}'")
 
         input_words = cleaned_value.split()
@@ -494,8 +618,7 @@ def select_or_type_modality(page, dropdown_arrow_xpath: str, dropdown_input_xpat
         cleaned_options = {}
         for option in available_options:
             modality_name = option.split("-")[0].strip()
-            cleaned_name = modality_name.replace("(", " ").replace(")", " ").replace(".", " ").replace(",", " ").strip()
-            cleaned_name = " ".join(cleaned_name.split())
+            cleaned_name = " ".join(modality_name.translate(_PUNCT_TRANSLATE).split())
             cleaned_options[cleaned_name] = option
         logger.info(f"Cleaned options: {list(cleaned_options.keys())}")
 
@@ -555,28 +678,24 @@ def select_or_type_service_desc(page, dropdown_arrow_xpath: str, dropdown_input_
         cleaned_value = extract_key_words(value)
         logger.info(f"Extracted key words from '{value}': '{cleaned_value}'")
 
-        cleaned_value = cleaned_value.replace("-", " ").replace("(", " ").replace(")", " ").replace(".", " ").replace(",", " ").strip()
-        noise_phrases = ['refer to other hospital', 'for', 'with', 'and']
-        for phrase in noise_phrases:
-            cleaned_value = re.sub(rf'\b{phrase}\b', ' ', cleaned_value, flags=re.IGNORECASE)
+        cleaned_value = cleaned_value.translate(_DASH_PUNCT_TRANSLATE).strip()
+        for pattern in _NOISE_PATTERNS:
+            cleaned_value = pattern.sub(' ', cleaned_value)
         cleaned_value = " ".join(cleaned_value.split())
         logger.info(f"Cleaned value after removing special characters and noise: '{cleaned_value}'")
 
         if "-" in value:
             parts = value.split("-")
             last_part = parts[-1].strip()
-            paren_match = re.search(r'\((.*?)\)\s*(.*)', last_part)
+            paren_match = _PAREN_SUFFIX_RE.search(last_part)
             if paren_match:
                 code, text_after = paren_match.groups()
                 if text_after.strip():
-                    cleaned_value = text_after.strip().replace("-", " ").replace("(", " ").replace(")", " ").replace(".", " ").replace(",", " ").strip()
-                    cleaned_value = " ".join(cleaned_value.split())
+                    cleaned_value = " ".join(text_after.translate(_DASH_PUNCT_TRANSLATE).split())
                 elif code.strip().replace(".", "").isalnum():
-                    cleaned_value = last_part.split("(")[0].strip().replace("-", " ").replace("(", " ").replace(")", " ").replace(".", " ").replace(",", " ").strip()
-                    cleaned_value = " ".join(cleaned_value.split())
+                    cleaned_value = " ".join(last_part.split("(")[0].translate(_DASH_PUNCT_TRANSLATE).split())
             else:
-                cleaned_value = parts[-1].strip().replace("-", " ").replace("(", " ").replace(")", " ").replace(".", " ").replace(",", " ").strip()
-                cleaned_value = " ".join(cleaned_value.split())
+                cleaned_value = " ".join(parts[-1].translate(_DASH_PUNCT_TRANSLATE).split())
         logger.info(f"Final cleaned value for service description: '{cleaned_value}'")
 
         key_words = cleaned_value.split()
@@ -598,7 +717,13 @@ def select_or_type_service_desc(page, dropdown_arrow_xpath: str, dropdown_input_
         logger.info(f"Text chunks for service description: {ordered_chunks}")
 
         list_xpath = f"//ul[@id='{list_id}']"
-        for chunk in ordered_chunks:
+        # The service list is filtered server-side by the typed text, so cache
+        # entries are keyed by the chunk that loaded them.
+        typed_chunk = ordered_chunks[0] if ordered_chunks else None
+        cached = _dropdown_cache.get(f"{list_xpath}|{typed_chunk}")
+        skip_typing = bool(cached and time.monotonic() - cached[0] < DROPDOWN_CACHE_TTL)
+        for chunk in ([] if skip_typing else ordered_chunks):
+            typed_chunk = chunk
             logger.info(f"Typing chunk: '{chunk}'")
             if find_element_with_fallback(page, dropdown_input_xpath, '//input[@name="ServiceNameId_input"]'):
                 page.click(f'xpath={dropdown_input_xpath}')
@@ -621,7 +746,7 @@ def select_or_type_service_desc(page, dropdown_arrow_xpath: str, dropdown_input_
                     return type_and_enter_kendo_dropdown(page, dropdown_input_xpath, cleaned_value)
                 continue
 
-        available_options = log_available_options(page, list_xpath)
+        available_options = cached_options(page, list_xpath, key=f"{list_xpath}|{typed_chunk}")
         if not available_options:
             logger.warning(f"No options loaded for service description at {list_xpath}")
             return type_and_enter_kendo_dropdown(page, dropdown_input_xpath, cleaned_value)
@@ -629,32 +754,47 @@ def select_or_type_service_desc(page, dropdown_arrow_xpath: str, dropdown_input_
         cleaned_options = []
         for option in available_options:
             modality_name = option.split("-", 1)[-1].strip() if "-" in option else option
-            cleaned_name = modality_name.replace("(", " ").replace(")", " ").replace(".", " ").replace(",", " ").strip()
-            cleaned_name = " ".join(cleaned_name.split())
+            cleaned_name = " ".join(modality_name.translate(_PUNCT_TRANSLATE).split())
             cleaned_options.append(cleaned_name)
         logger.info(f"Cleaned options for fuzzy matching: {cleaned_options}")
 
+        # Plain string matching settles most lookups, so only fall back to
+        # fuzzy scoring when no option equals or overlaps the cleaned value.
         best_match_cleaned = None
+        best_match_index = None
         best_score = 0
         best_chunk = None
-        for chunk in ordered_chunks:
-            match, score = process.extractOne(chunk, cleaned_options, scorer=fuzz.token_sort_ratio)
-            if score > best_score:
-                best_match_cleaned = match
-                best_score = score
-                best_chunk = chunk
-        logger.info(f"Best fuzzy match for chunks '{ordered_chunks}': '{best_match_cleaned}' with score {best_score} (from chunk '{best_chunk}')")
-
-        original_match, original_score = process.extractOne(cleaned_value, cleaned_options, scorer=fuzz.token_sort_ratio)
-        logger.info(f"Double-check with original '{cleaned_value}': '{original_match}' with score {original_score}")
+        original_score = 0
+        direct_index = direct_match_index(cleaned_value, cleaned_options)
+        if direct_index is not None:
+            best_match_index = direct_index
+            best_match_cleaned = cleaned_options[direct_index]
+            best_score = 100
+            logger.info(f"Direct match for '{cleaned_value}': '{best_match_cleaned}'")
+        else:
+            # token_sort_ratio is plain ratio over the sorted words, so sort each
+            # option once and score every chunk against them in one cdist call.
+            # argmax picks the first chunk (then option) with the top score
+            options_sorted = [sorted_tokens(opt) for opt in cleaned_options]
+            if ordered_chunks:
+                scores = process.cdist([sorted_tokens(chunk) for chunk in ordered_chunks], options_sorted, scorer=fuzz.ratio, workers=-1)
+                chunk_index, option_index = divmod(int(scores.argmax()), scores.shape[1])
+                if scores[chunk_index, option_index] > 0:
+                    best_match_index = option_index
+                    best_match_cleaned = cleaned_options[best_match_index]
+                    best_score = float(scores[chunk_index, option_index])
+                    best_chunk = ordered_chunks[chunk_index]
+            logger.info(f"Best fuzzy match for chunks '{ordered_chunks}': '{best_match_cleaned}' with score {best_score} (from chunk '{best_chunk}')")
+
+            _, original_score, original_index = process.extractOne(sorted_tokens(cleaned_value), options_sorted, scorer=fuzz.ratio)
+            original_match = cleaned_options[original_index]
+            logger.info(f"Double-check with original '{cleaned_value}': '{original_match}' with score {original_score}")
 
         if best_score >= 60 or original_score >= 60:
             if original_score >= 50 and (original_score > best_score or best_score < 60):
-                best_match_index = cleaned_options.index(original_match)
-                best_match = available_options[best_match_index]
+                best_match = available_options[original_index]
                 logger.info(f"Overriding chunk match with original match '{original_match}' (score {original_score} > {best_score})")
             else:
-                best_match_index = cleaned_options.index(best_match_cleaned)
                 best_match = available_options[best_match_index]
 
             type_value = best_match.split("-", 1)[-1].strip() if "-" in best_match else best_match
@@ -667,13 +807,18 @@ def select_or_type_service_desc(page, dropdown_arrow_xpath: str, dropdown_input_
             page.fill(f'xpath={dropdown_input_xpath}', type_value)
             page.wait_for_timeout(2000)
 
-            available_options = log_available_options(page, list_xpath)
+            available_options = cached_options(page, list_xpath, key=f"{list_xpath}|{type_value}")
             logger.info(f"Options after typing '{type_value}': {available_options}")
 
             if best_match in available_options:
                 target_index = available_options.index(best_match)
                 logger.info(f"Target option '{best_match}' found at index {target_index}")
 
+                if click_option_by_text(page, list_id, best_match):
+                    wait_for_ajax_idle(page)
+                    logger.info(f"Selected service description: '{best_match}' by clicking the list item")
+                    return best_match
+
                 page.click(f'xpath={dropdown_input_xpath}')
                 page.wait_for_timeout(500)
 
@@ -687,6 +832,7 @@ def select_or_type_service_desc(page, dropdown_arrow_xpath: str, dropdown_input_
                 return best_match
             else:
                 logger.warning(f"'{best_match}' not found in available options after typing '{type_value}': {available_options}")
+                invalidate_dropdown_cache(list_xpath)
                 page.press(f'xpath={dropdown_input_xpath}', "Control+a")
                 page.press(f'xpath={dropdown_input_xpath}', "Backspace")
                 page.fill(f'xpath={dropdown_input_xpath}', type_value)
@@ -701,12 +847,29 @@ def select_or_type_service_desc(page, dropdown_arrow_xpath: str, dropdown_input_
 
     except Exception as e:
         logger.error(f"Failed to process service description at {dropdown_arrow_xpath}: {str(e)}", exc_info=True)
+        invalidate_dropdown_cache(f"//ul[@id='{list_id}']")
         return type_and_enter_kendo_dropdown(page, dropdown_input_xpath, cleaned_value if 'cleaned_value' in locals() else value)
 
 # -------------------------
 # Networking helpers
 # -------------------------
 
+# One keep-alive session for every poll and download, so the 5 s polling loop
+# reuses its TCP/TLS connection instead of handshaking on each request.  The
+# pool matches the downloader's four worker threads.
+_session = requests.Session()
+_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+_session.mount("http://", _adapter)
+_session.mount("https://", _adapter)
+
+# Seconds the payload service behind UNIFIED_ENDPOINT may hold a POST poll
+# open ("Prefer: wait=N", RFC 7240) while nothing is ready.  That service must
+# answer 404 with "Preference-Applied: wait=N" after such a hold for the worker
+# to skip its poll_interval sleep.  This repo's api.py does not implement it
+# (its /v1/edited payload route is a GET); services that ignore the header
+# answer at once and the worker keeps its fixed interval.
+LONG_POLL_WAIT_SECONDS = 30
+
 # NOTE: The automation worker may start **before** the client uploads the
 # JSON / PDF payload to `UNIFIED_ENDPOINT`.  In that scenario the first
 # request will very likely return 4xx/5xx or a 200 without the expected
@@ -742,13 +905,19 @@ def fetch_files_from_endpoint(
     while deadline is None or time.time() < deadline:
         # Hold results of this attempt; child helpers will update this dict.
         found: dict[str, str | None] = {"json_file": None, "pdf_file": None}
+        held = False
 
         try:
             logger.info(
                 f"Attempt {attempt}: fetching files from POST endpoint: {endpoint}"
             )
 
-            response = requests.post(endpoint, timeout=10)
+            # Ask the server to hold the request until files are ready
+            # (RFC 7240 long poll); the read timeout leaves room for the hold.
+            response = _session.post(endpoint, headers={"Prefer": f"wait={LONG_POLL_WAIT_SECONDS}"}, timeout=(10, LONG_POLL_WAIT_SECONDS + 5), stream=True)
+            # Only an empty answer after a server-side hold replaces the sleep;
+            # a ready response without JSON must not turn into a busy loop.
+            held = response.status_code == 404 and "wait=" in response.headers.get("Preference-Applied", "")
 
             # Treat non-200 as "not ready yet" rather than fatal – unless it's
             # a 4xx other than 404 where the client clearly made a permanent
@@ -761,6 +930,7 @@ def fetch_files_from_endpoint(
                 logger.warning(
                     f"Attempt {attempt}: endpoint not ready (HTTP {response.status_code})."
                 )
+                response.close()  # hand the streamed connection back to the pool
                 raise http_err
 
             # -----------------------------------------------------------------
@@ -771,12 +941,7 @@ def fetch_files_from_endpoint(
             content_type_header = response.headers.get("Content-Type", "").lower()
 
             if "multipart" in content_type_header:
-                from email.parser import BytesParser
-                from email.policy import default
-
-                msg = BytesParser(policy=default).parsebytes(response.content)
-                for part in msg.iter_parts():
-                    _process_part(part, temp_dir, found)
+                _stream_multipart_response(response, temp_dir, found)
 
             else:
                 _process_non_multipart_response(response, temp_dir, found)
@@ -800,8 +965,11 @@ def fetch_files_from_endpoint(
                 exc_info=True,
             )
 
-        # Wait before next poll, unless the deadline has passed.
+        # Wait before next poll, unless the deadline has passed or the server
+        # already held the request for us.
         attempt += 1
+        if held:
+            continue
         if deadline is None:
             time.sleep(poll_interval_seconds)
         else:
@@ -831,28 +999,103 @@ def _save_bytes_to_file(path: str, data: bytes) -> None:
         f.write(data)
     logger.info(f"Saved file: {path}")
 
-def _process_part(part, temp_dir: str, result: _ResultDict):
-    """Process a single MIME part inside a multipart response."""
-    content_disposition = part.get("Content-Disposition", "")
-    content_type = part.get_content_type()
+def _stream_multipart_response(response, temp_dir: str, result: _ResultDict):
+    """Parse a streamed multipart response, writing each part to disk as it arrives."""
+    from multipart.multipart import MultipartParser, parse_options_header
+
+    _, params = parse_options_header(response.headers.get("Content-Type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise ValueError("Multipart response without a boundary")
+
+    state = {"headers": {}, "field": b"", "value": b"", "file": None, "index": -1}
+
+    def on_part_begin():
+        state["headers"] = {}
+        state["index"] += 1
+
+    def on_header_field(data, start, end):
+        state["field"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        state["value"] += data[start:end]
+
+    def on_header_end():
+        state["headers"][state["field"].decode("latin-1").lower()] = state["value"].decode("latin-1").strip()
+        state["field"] = state["value"] = b""
+
+    def on_headers_finished():
+        state["file"] = open(_process_part(state["headers"], temp_dir, result, state["index"]), "wb")
+
+    def on_part_data(data, start, end):
+        state["file"].write(data[start:end])
+
+    def on_part_end():
+        state["file"].close()
+        logger.info(f"Saved file: {state['file'].name}")
+        state["file"] = None
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+
+    # /v1/edited prefixes the body with top-level MIME headers, which the
+    # parser rejects; drop everything before the first delimiter.
+    delimiter = b"--" + boundary
+    preamble = b""
+    try:
+        for chunk in response.iter_content(chunk_size=64 * 1024):
+            if preamble is not None:
+                preamble += chunk
+                start = preamble.find(delimiter)
+                if start < 0:
+                    # Keep enough bytes to match a delimiter split across chunks.
+                    preamble = preamble[-len(delimiter):]
+                    continue
+                chunk, preamble = preamble[start:], None
+            parser.write(chunk)
+        parser.finalize()
+    finally:
+        if state["file"] is not None:
+            state["file"].close()
+
+def _save_stream_to_file(path: str, response) -> None:
+    """Copy a streamed response body to disk in 64 KB blocks."""
+    response.raw.decode_content = True  # undo gzip/deflate like response.content does
+    with open(path, "wb") as f:
+        shutil.copyfileobj(response.raw, f, length=1 << 16)
+    logger.info(f"Saved file: {path}")
+
+def _process_part(headers: dict[str, str], temp_dir: str, result: _ResultDict, index: int = 0) -> str:
+    """Name and classify a single MIME part; returns the path its body is written to."""
+    content_disposition = headers.get("content-disposition", "")
+    content_type = headers.get("content-type", "text/plain").split(";")[0].strip().lower()
     filename = None
 
     if content_disposition:
-        match = re.search(r'filename="([^"]+)"', content_disposition)
+        match = _FILENAME_RE.search(content_disposition)
         if match:
             filename = match.group(1)
 
     if not filename:
         ext = guess_extension(content_type) or ""
-        filename = f"file_{hash(content_type)}{ext}"
+        # Number unnamed parts by position so two parts of the same type
+        # don't overwrite each other.
+        filename = f"file_{index}{ext}"
 
     file_path = os.path.join(temp_dir, filename)
-    _save_bytes_to_file(file_path, part.get_payload(decode=True))
 
     if filename.lower().endswith(".json") or content_type == "application/json":
         result["json_file"] = file_path
     elif filename.lower().endswith(".pdf") or content_type == "application/pdf":
         result["pdf_file"] = file_path
+    return file_path
 
 def _process_non_multipart_response(response, temp_dir: str, result: _ResultDict):
     """Handle non-multipart responses (JSON object with URLs or base64)."""
@@ -875,26 +1118,38 @@ def _process_non_multipart_response(response, temp_dir: str, result: _ResultDict
             result["pdf_file"] = path
         return
 
+    # Download URL items in parallel, each into its own dict, then merge in
+    # payload order so a later item still wins exactly as it did serially.
+    downloads: dict[str, _ResultDict] = {}
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = []
+        for key, item in data.items():
+            if isinstance(item, dict) and "url" in item:
+                downloads[key] = {}
+                futures.append(executor.submit(_download_and_store_file, item["url"], temp_dir, downloads[key]))
+        for future in futures:
+            future.result()
+
     for key, item in data.items():
-        if isinstance(item, dict) and "url" in item:
-            _download_and_store_file(item["url"], temp_dir, result)
+        if key in downloads:
+            result.update(downloads[key])
         elif isinstance(item, str) and item.startswith("data:"):
             _save_base64_content(item, temp_dir, result)
 
 def _download_and_store_file(url: str, temp_dir: str, result: _ResultDict):
-    file_response = requests.get(url, timeout=10)
-    file_response.raise_for_status()
-    content_type = file_response.headers.get("Content-Type", "").lower()
-    filename = url.split("/")[-1]
+    with _session.get(url, timeout=10, stream=True) as file_response:
+        file_response.raise_for_status()
+        content_type = file_response.headers.get("Content-Type", "").lower()
+        filename = url.split("/")[-1]
 
-    if filename.lower().endswith(".json") or content_type == "application/json":
-        path = os.path.join(temp_dir, filename if filename.lower().endswith(".json") else "patient_data.json")
-        _save_bytes_to_file(path, file_response.content)
-        result["json_file"] = path
-    elif filename.lower().endswith(".pdf") or content_type == "application/pdf":
-        path = os.path.join(temp_dir, filename if filename.lower().endswith(".pdf") else "prescription.pdf")
-        _save_bytes_to_file(path, file_response.content)
-        result["pdf_file"] = path
+        if filename.lower().endswith(".json") or content_type == "application/json":
+            path = os.path.join(temp_dir, filename if filename.lower().endswith(".json") else "patient_data.json")
+            _save_stream_to_file(path, file_response)
+            result["json_file"] = path
+        elif filename.lower().endswith(".pdf") or content_type == "application/pdf":
+            path = os.path.join(temp_dir, filename if filename.lower().endswith(".pdf") else "prescription.pdf")
+            _save_stream_to_file(path, file_response)
+            result["pdf_file"] = path
 
 def _save_base64_content(data_uri: str, temp_dir: str, result: _ResultDict):
     import base64
@@ -949,7 +1204,6 @@ def upload_document(page, document_type: str, document_path: str, timeout: int =
         upload_button_xpath = '//button[@id="uploadDocsForService"]'
         if find_element_with_fallback(page, upload_button_xpath, '//button[contains(text(), "Upload")]'):
             page.click(f'xpath={upload_button_xpath}')
-            page.wait_for_timeout(2000)
             logger.info("Clicked Upload Documents button")
         else:
             logger.error("Upload Documents button not found")
@@ -979,20 +1233,26 @@ def upload_document(page, document_type: str, document_path: str, timeout: int =
 
         file_input_xpath = '//input[@id="filesvisitregForServcie"]'
         if find_element_with_fallback(page, file_input_xpath, '//input[@name="filesvisitregForServcie"]'):
-            page.set_input_files(f'xpath={file_input_xpath}', document_path)
-            page.wait_for_timeout(5000)
+            # The upload widget posts the file as soon as it is selected; wait for
+            # that response rather than sleeping a fixed 13 s.
+            try:
+                with page.expect_response(lambda r: r.request.method == "POST", timeout=13000):
+                    page.set_input_files(f'xpath={file_input_xpath}', document_path)
+            except PlaywrightTimeoutError:
+                logger.warning("No upload response seen within 13 s, continuing")
+            wait_for_ajax_idle(page)
             logger.info(f"Uploaded file: {document_path}")
         else:
             logger.error("File input field not found")
             return False
 
-        page.wait_for_timeout(8000)
-        logger.info("Waited for a few seconds after file upload")
-
         close_button_xpath = '//button[contains(@onclick, "closeuploadDocsForServicewindow")]'
         if find_element_with_fallback(page, close_button_xpath, '//button[contains(text(), "Close")]'):
             page.click(f'xpath={close_button_xpath}')
-            page.wait_for_timeout(2000)
+            try:
+                page.wait_for_selector(f'xpath={dialog_xpath}', state='hidden', timeout=5000)
+            except PlaywrightTimeoutError:
+                logger.warning("Upload Documents dialog still visible after closing")
             logger.info("Closed Upload Documents dialog")
         else:
             logger.error("Close button not found")
@@ -1216,7 +1476,6 @@ def process_field(page, field_name: str, value, extra_args=None):
     if method == "fill":
         if find_element_with_fallback(page, xpath, mapping.get("fallback"), mapping.get("label")):
             page.fill(xpath, str(value))
-            page.wait_for_timeout(1000)
             logger.info(log_message.format(value))
     elif method == "type_and_enter_kendo_dropdown":
         result = type_and_enter_kendo_dropdown(page, xpath, value)
@@ -1241,7 +1500,8 @@ def process_field(page, field_name: str, value, extra_args=None):
         )
         if result:
             logger.info(log_message.format(result))
-            page.wait_for_timeout(1500 if field_name in ["referring", "visit_type", "carrier"] else 3300 if field_name == "carrier_type" else 0)
+            # Selections such as carrier_type cascade into reloading dependent lists.
+            wait_for_ajax_idle(page)
     elif method == "select_or_type_modality":
         result = select_or_type_modality(
             page,
@@ -1276,7 +1536,7 @@ def process_field(page, field_name: str, value, extra_args=None):
     elif method == "click":
         if find_element_with_fallback(page, xpath, mapping.get("fallback")):
             page.click(f'xpath={xpath}')
-            page.wait_for_timeout(2000)
+            wait_for_ajax_idle(page)
             logger.info(log_message)
 
 def main():
@@ -1502,6 +1762,7 @@ def main():
                         ("save", None)
                     ]
 
+                    probe_field_xpaths(page)
                     for field_name, value in fields_to_process:
                         print(f"Processing {field_name.replace('_', ' ').title()}...")
                         if field_name == "id_type_and_document_id" and value[0]:
@@ -1,8 +1,10 @@
 import json
 import os
 import re
+import orjson
 from openai import OpenAI
 from dotenv import load_dotenv
+from pydantic import BaseModel
 from prompt import MAIN_PROMPT
 from models import StructuredOCR, Language, MedicalFormContent
 from typing import Dict, Any, List, Optional, Tuple
@@ -13,6 +15,30 @@ api_key = os.getenv("OPENAI_API_KEY")
 
 client = OpenAI(api_key=api_key)
 
+# Fields that should be treated as checkboxes
+CHECKBOX_FIELDS = [
+    "single", "married", "newVisit", "followUp", "refill", "walkIn", 
+    "inpatient", "outpatient", "emergencyCase", "chronic", "congenital", "rta",
+    "workRelated", "vaccination", "checkUp", "psychiatric", "infertility", "pregnancy",
+    "approved", "notApproved"
+]
+
+# Precompiled regex patterns (compiled once at import instead of per call)
+_CHECKBOX_YES_NO_RES = {
+    # Pattern like "Referral: Yes" or "Referral Yes"
+    field: re.compile(rf"\b{field}:?\s+(Yes|No)\b", re.IGNORECASE)
+    for field in CHECKBOX_FIELDS
+}
+_PAREN_RE = re.compile(r'\((.*?)\)')
+_KEY_RE = re.compile(r'\b(Name|ID|No|Date|Status|Type|Sex|Age|Class)\s+(?!:)')
+_BOOL_RE = re.compile(r'\b(true|false)\b', re.IGNORECASE)
+_PAYER_SPLIT_RE = re.compile(r'payer\s*:', re.IGNORECASE)
+_PRIMARY_CODE_RE = re.compile(r'\((\d+[^)]*-\d+[^)]*)\)')
+_ADDITIONAL_CODE_RE = re.compile(r'\((\d+)\)')
+_NUMBER_RE = re.compile(r'^\d+\.?\d*$')
+_CODE_LINE_RE = re.compile(r'^\d+[^a-zA-Z]*$')
+_WS_RE = re.compile(r'\s+')
+
 def clean_ocr_text(text: str) -> str:
     """Remove single quotes and commas from OCR text while preserving other punctuation."""
     # Split the text into lines
@@ -44,20 +70,10 @@ def process_checkboxes(text: str) -> str:
        - "Yes" -> true
        - "No" -> false
     """
-    # List of fields that should be treated as checkboxes
-    checkbox_fields = [
-        "single", "married", "newVisit", "followUp", "refill", "walkIn", 
-        "inpatient", "outpatient", "emergencyCase", "chronic", "congenital", "rta",
-        "workRelated", "vaccination", "checkUp", "psychiatric", "infertility", "pregnancy",
-        "approved", "notApproved"
-    ]
-    
     def process_line(line: str) -> str:
         # First handle explicit Yes/No values
-        for field in checkbox_fields:
-            # Look for pattern like "Referral: Yes" or "Referral Yes"
-            pattern = rf"\b{field}:?\s+(Yes|No)\b"
-            match = re.search(pattern, line, re.IGNORECASE)
+        for field, pattern in _CHECKBOX_YES_NO_RES.items():
+            match = pattern.search(line)
             if match:
                 value = match.group(1).lower() == "yes"
                 return line.replace(match.group(0), f"{field}: {str(value).lower()}")
@@ -70,7 +86,7 @@ def process_checkboxes(text: str) -> str:
             
             # Check if any of the preceding words match our checkbox fields
             is_checkbox_field = any(field.lower() in [word.lower() for word in pre_context] 
-                                  for field in checkbox_fields)
+                                  for field in CHECKBOX_FIELDS)
             
             if is_checkbox_field:
                 if not content:
@@ -80,7 +96,7 @@ def process_checkboxes(text: str) -> str:
             
             return f"({content})"
         
-        return re.sub(r'\((.*?)\)', checkbox_replacement, line)
+        return _PAREN_RE.sub(checkbox_replacement, line)
     
     # Process each line separately
     lines = text.split('\n')
@@ -100,14 +116,14 @@ def format_key_values(text: str) -> str:
             
             # Ensure key-value separation is consistent
             # Replace missing colons after known keys
-            line = re.sub(r'\b(Name|ID|No|Date|Status|Type|Sex|Age|Class)\s+(?!:)', r'\1: ', line)
+            line = _KEY_RE.sub(r'\1: ', line)
             
             # Handle multiple key-value pairs in same brackets
             if ' & ' in line:
                 line = line.replace(' & ', '\n')
             
             # Handle Yes/No values that might have been converted to true/false
-            line = re.sub(r'\b(true|false)\b', lambda m: m.group(0).lower(), line, flags=re.IGNORECASE)
+            line = _BOOL_RE.sub(lambda m: m.group(0).lower(), line)
         
         formatted_lines.append(line)
     
@@ -146,7 +162,7 @@ def find_payer_info(lines: List[str]) -> str:
         
         # Explicit payer marker
         if "payer:" in line_lower:
-            parts = re.split(r'payer\s*:', line, flags=re.IGNORECASE)
+            parts = _PAYER_SPLIT_RE.split(line)
             if len(parts) > 1:
                 payer_info.append(parts[1].strip())
         
@@ -186,7 +202,7 @@ def find_service_table_section(lines: List[str]) -> Tuple[List[str], str]:
                 start_idx = i
         
         # Look for parenthesized codes like (90911-00-00)
-        elif re.search(r'\(\d+[^)]*-\d+[^)]*\)', line_lower):
+        elif _PRIMARY_CODE_RE.search(line_lower):
             format1_score += 3
             if start_idx is None:
                 start_idx = i
@@ -231,7 +247,7 @@ def find_service_table_section(lines: List[str]) -> Tuple[List[str], str]:
     else:
         # If tied, check for additional signals
         for i, line in enumerate(lines):
-            if re.search(r'\((\d+[^)]*-\d+[^)]*)\)', line):
+            if _PRIMARY_CODE_RE.search(line):
                 format_type = 'format1'
                 break
         if format_type == 'unknown':
@@ -274,7 +290,7 @@ def extract_service_format1(table_lines: List[str]) -> List[Dict[str, Any]]:
     
     for i, line in enumerate(all_lines):
         # Check if line contains a primary service code
-        if re.search(r'\((\d+[^)]*-\d+[^)]*)\)', line):
+        if _PRIMARY_CODE_RE.search(line):
             # If we already have a section, save it
             if current_section:
                 service_sections.append(current_section)
@@ -297,7 +313,7 @@ def extract_service_format1(table_lines: List[str]) -> List[Dict[str, Any]]:
         
         # Extract primary code
         for line in section:
-            primary_match = re.search(r'\((\d+[^)]*-\d+[^)]*)\)', line)
+            primary_match = _PRIMARY_CODE_RE.search(line)
             if primary_match:
                 service['code'] = primary_match.group(1)
                 
@@ -316,17 +332,17 @@ def extract_service_format1(table_lines: List[str]) -> List[Dict[str, Any]]:
         for line in section:
             # Look for additional codes but not the primary code
             if 'code' in service and service['code'] not in line:
-                add_match = re.search(r'\((\d+)\)', line)
+                add_match = _ADDITIONAL_CODE_RE.search(line)
                 if add_match:
                     additional_codes.append(add_match.group(1))
                     
                     # If the additional code is in a line with text, add to description
                     if 'description' not in service:
-                        text_without_code = re.sub(r'\(\d+\)', '', line).strip()
+                        text_without_code = _ADDITIONAL_CODE_RE.sub('', line).strip()
                         if text_without_code:
                             service['description'] = text_without_code
                     else:
-                        text_without_code = re.sub(r'\(\d+\)', '', line).strip()
+                        text_without_code = _ADDITIONAL_CODE_RE.sub('', line).strip()
                         if text_without_code and text_without_code not in service['description']:
                             service['description'] += " " + text_without_code
         
@@ -342,7 +358,7 @@ def extract_service_format1(table_lines: List[str]) -> List[Dict[str, Any]]:
         # Look for numeric values
         numeric_values = []
         for line in section:
-            if re.match(r'^\d+\.?\d*$', line):
+            if _NUMBER_RE.match(line):
                 numeric_values.append(float(line))
         
         # Assign numeric values to fields
@@ -398,7 +414,7 @@ def extract_service_format2(table_lines: List[str]) -> List[Dict[str, Any]]:
         
         # Try to find where data starts after these headings
         for i, line in enumerate(table_lines):
-            if re.match(r'^\d+[^a-zA-Z]*$', line.strip()):
+            if _CODE_LINE_RE.match(line.strip()):
                 data_start = i
                 break
     
@@ -436,7 +452,7 @@ def extract_service_format2(table_lines: List[str]) -> List[Dict[str, Any]]:
             continue
         
         # Check if this is a code line (indicates start of new service)
-        if re.match(r'^\d+[^a-zA-Z]*$', line) and (field_index == 0 or field_index >= len(headers)):
+        if _CODE_LINE_RE.match(line) and (field_index == 0 or field_index >= len(headers)):
             # Save previous service if exists
             if current_row and 'code' in current_row:
                 services.append(current_row)
@@ -461,7 +477,7 @@ def extract_service_format2(table_lines: List[str]) -> List[Dict[str, Any]]:
                 
                 if field_name:
                     # Handle numeric fields
-                    if field_name in ['reqQty', 'reqCost', 'appQty', 'appCost', 'grossAmount', 'appGross', 'note'] and re.match(r'^\d+\.?\d*$', line):
+                    if field_name in ['reqQty', 'reqCost', 'appQty', 'appCost', 'grossAmount', 'appGross', 'note'] and _NUMBER_RE.match(line):
                         current_row[field_name] = float(line)
                     else:
                         current_row[field_name] = line
@@ -502,7 +518,7 @@ def clean_service_description(raw_description: str) -> str:
     clean_description = raw_description[:earliest_cutoff].strip()
     
     # Clean up extra spaces
-    clean_description = re.sub(r'\s+', ' ', clean_description).strip()
+    clean_description = _WS_RE.sub(' ', clean_description).strip()
     return clean_description
 
 def convert_to_json(ocr_text: str, file_name: str) -> Dict[str, Any]:
@@ -599,7 +615,7 @@ Important guidelines:
         # Extract payer information using specialized function
         lines = ocr_text.split('\n')
         payer_info = find_payer_info(lines)
-        if payer_info and "ocr_contents" in structured_data.model_dump(exclude_none=True):
+        if payer_info:
             # Update the payer information in the structured data
             json_data = structured_data.model_dump(exclude_none=True)
             # Check if payerInfo exists in the JSON, if not create it
@@ -636,7 +652,7 @@ Important guidelines:
             elif not services and format_type == 'format2':
                 services = extract_service_format1(table_lines)
             
-            if services and "ocr_contents" in structured_data.model_dump(exclude_none=True):
+            if services:
                 # Add the services to the OCR contents
                 formatted_services = []
                 
@@ -688,6 +704,12 @@ Important guidelines:
         print(f"Error processing JSON: {e}")
         return None
 
+def _orjson_default(obj):
+    """Serialize values orjson doesn't handle natively, e.g. pydantic models."""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json", exclude_none=True)
+    return str(obj)
+
 def main():
     # Input and output paths
     input_md = "outputs/az_results_1.md"
@@ -704,8 +726,8 @@ def main():
     
     if json_data:
         # Write the JSON output
-        with open(output_json, 'w', encoding='utf-8') as f:
-            json.dump(json_data, f, indent=2, ensure_ascii=False)
+        with open(output_json, 'wb') as f:
+            f.write(orjson.dumps(json_data, option=orjson.OPT_INDENT_2, default=_orjson_default))
         print(f"Successfully converted {input_md} to {output_json}")
     else:
         print("Failed to convert OCR text to JSON")
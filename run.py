@@ -1,9 +1,21 @@
+import os
 import uvicorn
 
 if __name__ == "__main__":
-    uvicorn.run(
-        "api:app",
-        host="0.0.0.0",
-        port=8007,
-        reload=True
-    )
\ No newline at end of file
+    # Set DEV=1 for the single-process auto-reloading server
+    if os.getenv("DEV"):
+        uvicorn.run(
+            "api:app",
+            host="0.0.0.0",
+            port=8007,
+            reload=True
+        )
+    else:
+        uvicorn.run(
+            "api:app",
+            host="0.0.0.0",
+            port=8007,
+            workers=max(2, (os.cpu_count() or 1) // 2),
+            loop="uvloop",
+            http="httptools"
+        )
\ No newline at end of file
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+"""Tests for the streamed multipart parsing in endpoint_upload."""
+
+import os
+
+import pytest
+
+# endpoint_upload exits on import without these
+os.environ.setdefault("UNIFIED_ENDPOINT", "http://localhost/v1/edited")
+os.environ.setdefault("USERNAME", "test")
+os.environ.setdefault("PASSWORD", "test")
+
+pytest.importorskip("playwright")
+pytest.importorskip("multipart")
+
+from endpoint_upload import _stream_multipart_response
+
+BOUNDARY = "edited-7f3a9c"
+JSON_BODY = b'{"patient": {"name": "Test Patient"}, "services": []}'
+PDF_BODY = b"%PDF-1.4\n" + bytes(range(256)) * 40 + b"\n%%EOF"
+
+class FakeResponse:
+    """Stands in for a streamed requests.Response, yielding *chunk* bytes at a time."""
+
+    def __init__(self, body: bytes, chunk: int):
+        self.body = body
+        self.chunk = chunk
+        self.headers = {"Content-Type": f"multipart/mixed; boundary={BOUNDARY}"}
+
+    def iter_content(self, chunk_size=None):
+        for i in range(0, len(self.body), self.chunk):
+            yield self.body[i:i + self.chunk]
+
+def edited_body() -> bytes:
+    """A /v1/edited response body, top-level MIME headers included."""
+    body = (
+        f'Content-Type: multipart/mixed; boundary="{BOUNDARY}"\r\n'
+        "MIME-Version: 1.0\r\n\r\n"
+    ).encode()
+    for filename, content_type, data in (
+        ("patient.json", "application/json", JSON_BODY),
+        ("document.pdf", "application/pdf", PDF_BODY),
+    ):
+        body += (
+            f"--{BOUNDARY}\r\n"
+            f"Content-Type: {content_type}\r\n"
+            f'Content-Disposition: attachment; filename="{filename}"\r\n'
+            "Content-Transfer-Encoding: binary\r\n\r\n"
+        ).encode() + data + b"\r\n"
+    return body + f"--{BOUNDARY}--\r\n".encode()
+
+# Chunk sizes smaller than the delimiter split it across reads
+@pytest.mark.parametrize("chunk", [1, 5, 13, 64 * 1024])
+def test_stream_multipart_response_splits_parts(tmp_path, chunk):
+    result = {"json_file": None, "pdf_file": None}
+    _stream_multipart_response(FakeResponse(edited_body(), chunk), str(tmp_path), result)
+
+    assert sorted(os.listdir(tmp_path)) == ["document.pdf", "patient.json"]
+    assert result["json_file"] == str(tmp_path / "patient.json")
+    assert result["pdf_file"] == str(tmp_path / "document.pdf")
+    assert (tmp_path / "patient.json").read_bytes() == JSON_BODY
+    assert (tmp_path / "document.pdf").read_bytes() == PDF_BODY